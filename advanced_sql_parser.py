@@ -15,10 +15,11 @@ Features:
       - _extract_with_clauses, _parse_cte_block, _parse_cte_as_clause
       - _extract_subselect_tokens, _is_subselect, _extract_main_from, _parse_identifier
       - _extract_columns, _parse_select_list, _parse_dml_columns, _parse_update_set_list
+  • Results are memoized per SQL text (LRU), so identical rule SQL is only tokenized once.
   • Comprehensive logging and error handling for production readiness.
 
 Dependencies:
-  • sqlparse, logging, json
+  • sqlparse, logging, json, functools
 
 Usage:
   Import and call the functions to determine the operation type or parse SQL dependencies.
@@ -31,12 +32,39 @@ Example:
 
 import logging
 import json
+import functools
+from collections import deque
 import sqlparse
 from sqlparse.sql import Identifier, IdentifierList, Parenthesis
 from sqlparse.tokens import Keyword, DML
+from sqlparse.engine import FilterStack
+from advlog import configure_logging, default_log_level
 
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
+logger.setLevel(default_log_level())
+
+# Keyword sets compared against sqlparse's pre-uppercased `token.normalized`.
+_FROM_KEYWORDS = frozenset({
+    "FROM", "JOIN", "INNER JOIN", "LEFT JOIN", "RIGHT JOIN", "FULL JOIN", "CROSS JOIN",
+    "LEFT OUTER JOIN", "RIGHT OUTER JOIN", "FULL OUTER JOIN"
+})
+_SELECT_TERMINATORS = frozenset({
+    "FROM", "JOIN", "WHERE", "GROUP", "ORDER", "UNION", "INTERSECT", "HAVING", "LIMIT"
+})
+_SELECT_MODIFIERS = frozenset({"DISTINCT", "TOP", "ALL"})
+_DML_KEYWORDS = frozenset({"SELECT", "INSERT", "UPDATE", "DELETE"})
+_SET_TERMINATORS = frozenset({"WHERE", "FROM"})
+# One grouping-enabled sqlparse pipeline for the whole module. FilterStack.run() keeps
+# no per-call state, so the stack can be shared instead of rebuilt by every sqlparse.parse().
+_FILTER_STACK = FilterStack()
+_FILTER_STACK.enable_grouping()
+
+# Leading character -> the only operation keyword it can start.
+_OPERATION_BY_FIRST_CHAR = {"I": "INSERT", "U": "UPDATE", "D": "DELETE", "S": "SELECT"}
+
+# SQL longer than this is parsed without caching, so a single huge script cannot
+# pin its text and parse results in the cache.
+PARSE_CACHE_MAX_SQL = 200_000
 
 # --- Public Functions ---
 
@@ -45,23 +73,19 @@ def detect_operation_type(rule_sql: str, decision_table_id=None) -> str:
     Determine the SQL operation type based on the rule SQL.
     If rule_sql is empty but decision_table_id is provided, returns 'DECISION_TABLE'.
     Otherwise, returns one of: INSERT, UPDATE, DELETE, SELECT, or OTHER.
+    Only the leading keyword is uppercased, so cost does not grow with the SQL length.
     """
     try:
-        if (not rule_sql.strip()) and decision_table_id:
+        txt = rule_sql.lstrip()
+        if (not txt) and decision_table_id:
             return "DECISION_TABLE"
-        txt = rule_sql.strip().upper()
-        if txt.startswith("INSERT"):
-            return "INSERT"
-        elif txt.startswith("UPDATE"):
-            return "UPDATE"
-        elif txt.startswith("DELETE"):
-            return "DELETE"
-        elif txt.startswith("SELECT"):
-            return "SELECT"
-        else:
-            return "OTHER"
+        head = txt[:6].upper()
+        op_type = _OPERATION_BY_FIRST_CHAR.get(head[:1])
+        if op_type and head == op_type:
+            return op_type
+        return "OTHER"
     except Exception as ex:
-        logger.error(f"Error in detect_operation_type: {ex}")
+        logger.error("Error in detect_operation_type: %s", ex)
         return "OTHER"
 
 
@@ -78,6 +102,49 @@ def parse_sql_dependencies(sql_text: str) -> dict:
       'cte_tables': list of tuples (cte_name, list of its table references)
       'alias_map': dict mapping alias -> (schema, table)
       'columns': list of tuples (column_name, is_write, is_read)
+
+    The parse itself is cached per SQL text; every call returns fresh containers,
+    so callers are free to mutate the result.
+    """
+    try:
+        key = sql_text.strip()
+    except Exception as ex:
+        logger.error("Error in parse_sql_dependencies: %s", ex)
+        return {"tables": [], "cte_tables": [], "alias_map": {}, "columns": []}
+    if len(key) > PARSE_CACHE_MAX_SQL:
+        parsed = _parse_sql_dependencies_cached.__wrapped__(key)
+    else:
+        parsed = _parse_sql_dependencies_cached(key)
+    tables, cte_tables, alias_items, columns = parsed
+    return {
+        "tables": list(tables),
+        "cte_tables": [(cte_name, list(cte_refs)) for cte_name, cte_refs in cte_tables],
+        "alias_map": dict(alias_items),
+        "columns": list(columns)
+    }
+
+
+@functools.lru_cache(maxsize=2048)
+def _parse_sql_dependencies_cached(sql_text: str) -> tuple:
+    """
+    Cached worker behind parse_sql_dependencies.
+    Returns an immutable (tables, cte_tables, alias_map items, columns) tuple so a
+    single cache entry can be shared safely between callers.
+    """
+    dependencies = _parse_with_sqlparse(sql_text)
+    # Ensure uniqueness of table references (order-preserving)
+    dependencies["tables"] = list(dict.fromkeys(dependencies["tables"]))
+    return (
+        tuple(dependencies["tables"]),
+        tuple((cte_name, tuple(cte_refs)) for cte_name, cte_refs in dependencies["cte_tables"]),
+        tuple(dependencies["alias_map"].items()),
+        tuple(dependencies["columns"])
+    )
+
+
+def _parse_with_sqlparse(sql_text: str) -> dict:
+    """
+    Extract dependencies by walking the sqlparse token tree of each statement.
     """
     dependencies = {
         "tables": [],
@@ -85,44 +152,47 @@ def parse_sql_dependencies(sql_text: str) -> dict:
         "alias_map": {},
         "columns": []
     }
+    seen = set()
+    # _is_subselect results keyed by id(token); the token tree is alive for this whole call.
+    subselect_memo = {}
     try:
-        statements = sqlparse.parse(sql_text)
-        for stmt in statements:
-            ctes = _extract_with_clauses(stmt)
+        # Statements are consumed as the splitter yields them; no intermediate tuple.
+        for stmt in _FILTER_STACK.run(sql_text):
+            ctes = _extract_with_clauses(stmt, subselect_memo)
             for cte_name, cte_refs in ctes.items():
                 dependencies["cte_tables"].append((cte_name, cte_refs))
-            main_tables, alias_map = _extract_main_from(stmt.tokens, set(ctes.keys()))
+            # Upper-cased once per statement; _parse_identifier does a single set lookup.
+            known_cte_upper = frozenset(name.upper() for name in ctes if name)
+            main_tables, alias_map = _extract_main_from(stmt.tokens, known_cte_upper, seen, subselect_memo)
             dependencies["tables"].extend(main_tables)
             dependencies["alias_map"].update(alias_map)
             cols = _extract_columns(stmt)
             dependencies["columns"].extend(cols)
-        # Ensure uniqueness of table references
-        dependencies["tables"] = list({tbl: tbl for tbl in dependencies["tables"]}.values())
-        return dependencies
     except Exception as ex:
-        logger.error(f"Error in parse_sql_dependencies: {ex}")
-        return dependencies
+        logger.error("Error in parse_sql_dependencies: %s", ex)
+    return dependencies
+
 
 # --- Helper Functions for SQL Parsing ---
 
-def _extract_with_clauses(statement) -> dict:
+def _extract_with_clauses(statement, subselect_memo: dict = None) -> dict:
     """
     Extracts CTE definitions from a SQL statement.
     Returns a dictionary mapping CTE names to their extracted table references.
     """
     cte_map = {}
-    tokens = list(statement.tokens)
+    tokens = statement.tokens
     i = 0
     while i < len(tokens):
         token = tokens[i]
-        if token.ttype is Keyword and token.value.upper() == "WITH":
+        if token.ttype is Keyword and token.normalized == "WITH":
             i += 1
-            i = _parse_cte_block(tokens, i, cte_map)
+            i = _parse_cte_block(tokens, i, cte_map, subselect_memo)
         else:
             i += 1
     return cte_map
 
-def _parse_cte_block(tokens, i: int, cte_map: dict) -> int:
+def _parse_cte_block(tokens, i: int, cte_map: dict, subselect_memo: dict = None) -> int:
     """
     Parses the tokens following a WITH keyword to extract CTE definitions.
     """
@@ -131,14 +201,14 @@ def _parse_cte_block(tokens, i: int, cte_map: dict) -> int:
         if isinstance(token, Identifier):
             cte_name = token.get_real_name()
             i += 1
-            i = _parse_cte_as_clause(tokens, i, cte_name, cte_map)
-        elif token.ttype is Keyword and token.value.upper() in ("SELECT", "INSERT", "UPDATE", "DELETE"):
+            i = _parse_cte_as_clause(tokens, i, cte_name, cte_map, subselect_memo)
+        elif token.ttype is Keyword and token.normalized in _DML_KEYWORDS:
             return i
         else:
             i += 1
     return i
 
-def _parse_cte_as_clause(tokens, i: int, cte_name: str, cte_map: dict) -> int:
+def _parse_cte_as_clause(tokens, i: int, cte_name: str, cte_map: dict, subselect_memo: dict = None) -> int:
     """
     Parses the AS clause for a given CTE and stores its subselect table references.
     """
@@ -149,7 +219,7 @@ def _parse_cte_as_clause(tokens, i: int, cte_name: str, cte_map: dict) -> int:
             if i < len(tokens):
                 sub_token = tokens[i]
                 if isinstance(sub_token, Parenthesis):
-                    sub_refs = _extract_subselect_tokens(sub_token.tokens)
+                    sub_refs = _extract_subselect_tokens(sub_token.tokens, subselect_memo)
                     cte_map[cte_name] = sub_refs
                     i += 1
                     return i
@@ -157,94 +227,126 @@ def _parse_cte_as_clause(tokens, i: int, cte_name: str, cte_map: dict) -> int:
             i += 1
     return i
 
-def _extract_subselect_tokens(tokens) -> list:
+def _extract_subselect_tokens(tokens, subselect_memo: dict = None) -> list:
     """
     Extract table references from a list of tokens inside a subselect.
     Returns a list of tuples: (schema, table, alias, is_subselect=True).
+
+    Nested subselects are walked with an explicit stack rather than recursion, so
+    deeply nested SQL cannot hit the recursion limit. Each frame holds
+    [token iterator, from_seen, group token waiting for its own FROM handling].
     """
     results = []
-    from_seen = False
-    i = 0
-    while i < len(tokens):
-        token = tokens[i]
-        if token.is_group and _is_subselect(token):
-            results.extend(_extract_subselect_tokens(token.tokens))
+    # Hot loop: bind attribute/global lookups to locals once.
+    results_append = results.append
+    parse_identifier = _parse_identifier
+    is_subselect = _is_subselect
+    no_ctes = frozenset()
+    stack = deque([[iter(tokens), False, None]])
+    while stack:
+        frame = stack[-1]
+        token = frame[2]
+        if token is not None:
+            # Nested subselect finished; now handle the group token itself.
+            frame[2] = None
+        else:
+            token = next(frame[0], None)
+            if token is None:
+                stack.pop()
+                continue
+            if token.is_group and is_subselect(token, subselect_memo):
+                frame[2] = token
+                stack.append([iter(token.tokens), False, None])
+                continue
         if token.ttype is Keyword:
-            value = token.value.upper()
-            if value in ("FROM", "JOIN", "INNER JOIN", "LEFT JOIN", "RIGHT JOIN", "FULL JOIN"):
-                from_seen = True
-            else:
-                from_seen = False
-        if from_seen:
+            frame[1] = token.normalized in _FROM_KEYWORDS
+        if frame[1]:
             if isinstance(token, IdentifierList):
                 for ident in token.get_identifiers():
-                    ref = _parse_identifier(ident, set())
+                    ref = parse_identifier(ident, no_ctes)
                     # Mark as coming from subselect
-                    results.append((ref[0], ref[1], ref[2], True))
+                    results_append((ref[0], ref[1], ref[2], True))
             elif isinstance(token, Identifier):
-                ref = _parse_identifier(token, set())
-                results.append((ref[0], ref[1], ref[2], True))
-        i += 1
+                ref = parse_identifier(token, no_ctes)
+                results_append((ref[0], ref[1], ref[2], True))
     return results
 
-def _is_subselect(token) -> bool:
+def _is_subselect(token, memo: dict = None) -> bool:
     """
     Determines if a token contains a subselect.
+    When a memo dict is supplied, results are cached by id(token) for the lifetime
+    of a single parse.
     """
     if not token.is_group:
         return False
+    if memo is not None:
+        cached = memo.get(id(token))
+        if cached is not None:
+            return cached
+    result = False
     for subtoken in token.tokens:
-        if subtoken.ttype is DML and subtoken.value.upper() == "SELECT":
-            return True
-    return False
+        if subtoken.ttype is DML and subtoken.normalized == "SELECT":
+            result = True
+            break
+    if memo is not None:
+        memo[id(token)] = result
+    return result
 
-def _extract_main_from(token_list, known_cte_names: set) -> tuple:
+def _extract_main_from(token_list, known_cte_upper: frozenset, seen: set = None, subselect_memo: dict = None) -> tuple:
     """
     Extracts table references and alias mappings from the main part of a SQL statement,
-    excluding any CTEs that are defined in known_cte_names.
+    marking references to the CTEs named (upper-cased) in known_cte_upper.
     
     Returns a tuple (results, alias_map), where results is a list of table reference tuples,
     and alias_map is a dict mapping alias names to (schema, table) tuples.
+    References already in `seen` (shared across statements by the caller) are not repeated.
     """
     results = []
     alias_map = {}
-    tokens = list(token_list)
+    if seen is None:
+        seen = set()
+    # Hot loop: bind attribute/global lookups to locals once.
+    results_append = results.append
+    seen_add = seen.add
+    alias_set = alias_map.__setitem__
+    parse_identifier = _parse_identifier
     from_seen = False
-    i = 0
-    while i < len(tokens):
-        token = tokens[i]
-        if token.is_group and _is_subselect(token):
-            results.extend(_extract_subselect_tokens(token.tokens))
+    for token in token_list:
+        if token.is_group and _is_subselect(token, subselect_memo):
+            for ref in _extract_subselect_tokens(token.tokens, subselect_memo):
+                if ref not in seen:
+                    seen_add(ref)
+                    results_append(ref)
         if token.ttype is Keyword:
-            val = token.value.upper()
-            if val in ("FROM", "JOIN", "INNER JOIN", "LEFT JOIN", "RIGHT JOIN", "FULL JOIN"):
-                from_seen = True
-            else:
-                from_seen = False
+            from_seen = token.normalized in _FROM_KEYWORDS
         if from_seen:
             if isinstance(token, IdentifierList):
                 for ident in token.get_identifiers():
-                    ref = _parse_identifier(ident, known_cte_names)
-                    results.append(ref)
+                    ref = parse_identifier(ident, known_cte_upper)
+                    if ref not in seen:
+                        seen_add(ref)
+                        results_append(ref)
                     if ref[2]:
-                        alias_map[ref[2]] = (ref[0], ref[1])
+                        alias_set(ref[2], (ref[0], ref[1]))
             elif isinstance(token, Identifier):
-                ref = _parse_identifier(token, known_cte_names)
-                results.append(ref)
+                ref = parse_identifier(token, known_cte_upper)
+                if ref not in seen:
+                    seen_add(ref)
+                    results_append(ref)
                 if ref[2]:
-                    alias_map[ref[2]] = (ref[0], ref[1])
-        i += 1
+                    alias_set(ref[2], (ref[0], ref[1]))
     return (results, alias_map)
 
-def _parse_identifier(ident, known_cte_names: set) -> tuple:
+def _parse_identifier(ident, known_cte_upper: frozenset) -> tuple:
     """
     Parse an Identifier token to extract schema name, real table name, and alias.
-    If the real table name is in known_cte_names, it returns a special tuple indicating a CTE.
+    If the upper-cased real table name is in known_cte_upper, it returns a special tuple
+    indicating a CTE.
     """
     alias = ident.get_alias()
     real_name = ident.get_real_name()
     schema_name = ident.get_parent_name()
-    if real_name and real_name.upper() in {n.upper() for n in known_cte_names}:
+    if real_name and real_name.upper() in known_cte_upper:
         return (None, f"(CTE) {real_name}", alias, False)
     return (schema_name, real_name, alias, False)
 
@@ -254,20 +356,21 @@ def _extract_columns(statement) -> list:
     Returns a list of tuples: (column_name, is_write, is_read)
     """
     results = []
-    tokens = list(statement.tokens)
+    results_append = results.append
+    parse_select_list = _parse_select_list
+    parse_dml_columns = _parse_dml_columns
+    tokens = statement.tokens
     i = 0
     while i < len(tokens):
         token = tokens[i]
         if token.ttype is DML:
-            word = token.value.upper()
+            word = token.normalized
             if word == "SELECT":
-                select_cols = _parse_select_list(tokens, i + 1)
-                for col in select_cols:
-                    results.append((col, False, True))
+                for col in parse_select_list(tokens, i + 1):
+                    results_append((col, False, True))
             elif word in ("INSERT", "UPDATE"):
-                dml_cols = _parse_dml_columns(tokens, i, word)
-                for col in dml_cols:
-                    results.append((col, True, False))
+                for col in parse_dml_columns(tokens, i, word):
+                    results_append((col, True, False))
         i += 1
     return results
 
@@ -279,17 +382,16 @@ def _parse_select_list(tokens, start_idx: int) -> list:
     i = start_idx
     while i < len(tokens):
         token = tokens[i]
-        if token.ttype is Keyword:
-            if token.value.upper() in ("FROM", "JOIN", "WHERE", "GROUP", "ORDER", "UNION", "INTERSECT"):
-                break
+        if token.ttype is Keyword and token.normalized in _SELECT_TERMINATORS:
+            break
         if isinstance(token, IdentifierList):
             for ident in token.get_identifiers():
                 name = ident.get_name()
-                if name and name.upper() not in ("DISTINCT", "TOP", "ALL"):
+                if name and name.upper() not in _SELECT_MODIFIERS:
                     columns.append(name)
         elif isinstance(token, Identifier):
             name = token.get_name()
-            if name and name.upper() not in ("DISTINCT", "TOP", "ALL"):
+            if name and name.upper() not in _SELECT_MODIFIERS:
                 columns.append(name)
         i += 1
     return columns
@@ -318,7 +420,7 @@ def _parse_dml_columns(tokens, start_idx: int, dml_word: str) -> list:
         i = start_idx
         while i < len(tokens):
             token = tokens[i]
-            if token.ttype is Keyword and token.value.upper() == "SET":
+            if token.ttype is Keyword and token.normalized == "SET":
                 found_set = True
                 i += 1
                 columns.extend(_parse_update_set_list(tokens, i))
@@ -334,7 +436,7 @@ def _parse_update_set_list(tokens, start_i: int) -> list:
     i = start_i
     while i < len(tokens):
         token = tokens[i]
-        if token.ttype is Keyword and token.value.upper() in ("WHERE", "FROM"):
+        if token.ttype is Keyword and token.normalized in _SET_TERMINATORS:
             break
         if isinstance(token, Identifier):
             columns.append(token.get_name())
@@ -344,6 +446,7 @@ def _parse_update_set_list(tokens, start_i: int) -> list:
 
 # For standalone testing
 if __name__ == '__main__':
+    configure_logging()
     sample_sql = """
     WITH cte AS (
         SELECT id, name FROM Orders
@@ -12,34 +12,109 @@ Features:
       - Success/fail outcome
       - Additional custom message details
   • Uses standard formatting and can easily be extended to log to multiple handlers (e.g., file, console, remote).
+  • Nothing is configured at import time; the application entry point calls configure_logging() once.
+    If no entry point did and the root logger has no handlers, the first log_event/log_error
+    call applies the default configuration.
+  • Event details are serialized to JSON only when a record is actually emitted.
 
 Usage:
-  Import functions such as log_simulation_result or log_event in your modules to record simulation outcomes.
+  Call configure_logging() once at startup, then import functions such as log_simulation_result
+  or log_event in your modules to record simulation outcomes.
   
 Example:
-    from advanced_logging import log_simulation_result
+    from advanced_logging import configure_logging, log_simulation_result
+    configure_logging()
     log_simulation_result("DryRun Simulation", record_count=125, success=True, message="All validations passed")
 """
 
-import logging
+import os
 import json
+import logging
+import logging.handlers
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
-# Configure a global logger
 LOG_FORMAT = "%(asctime)s - %(levelname)s - %(name)s - %(message)s"
-logging.basicConfig(
-    filename="brm_tool_production.log",
-    level=logging.DEBUG,
-    format=LOG_FORMAT,
-    datefmt="%Y-%m-%d %H:%M:%S"
-)
+LOG_FILENAME = "brm_tool_production.log"
+LOG_MAX_BYTES = 50 * 1024 * 1024
+LOG_BACKUP_COUNT = 10
+# Set this environment variable to any non-empty value to log at DEBUG.
+LOG_DEBUG_ENV = "BRM_LOG_DEBUG"
 logger = logging.getLogger("BRMTool")
 
-# Optionally add a console handler for development
-console_handler = logging.StreamHandler()
-console_handler.setLevel(logging.INFO)
-console_formatter = logging.Formatter(LOG_FORMAT)
-console_handler.setFormatter(console_formatter)
-logger.addHandler(console_handler)
+_configured = False
+
+
+def default_log_level() -> int:
+    """Return DEBUG when the LOG_DEBUG_ENV environment variable is set, else INFO."""
+    return logging.DEBUG if os.environ.get(LOG_DEBUG_ENV) else logging.INFO
+
+
+def configure_logging(path: str = LOG_FILENAME, level: int = None, console: bool = True):
+    """
+    Configure the global log file (and optionally a console handler for development).
+    Intended to be called once from the application entry point; repeated calls are ignored.
+    The file rotates at LOG_MAX_BYTES, keeping LOG_BACKUP_COUNT old files.
+    
+    Args:
+        path (str): Log file path.
+        level (int): Root logging level; defaults to INFO, or DEBUG when the
+            BRM_LOG_DEBUG environment variable is set.
+        console (bool): Also echo INFO and above to the console.
+    """
+    global _configured
+    if _configured:
+        return
+    if level is None:
+        level = default_log_level()
+    file_handler = logging.handlers.RotatingFileHandler(
+        path, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT
+    )
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT, datefmt="%Y-%m-%d %H:%M:%S"))
+    root = logging.getLogger()
+    root.addHandler(file_handler)
+    root.setLevel(level)
+    if console:
+        console_handler = logging.StreamHandler()
+        console_handler.setLevel(logging.INFO)
+        console_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        logger.addHandler(console_handler)
+    _configured = True
+
+
+def _ensure_configured():
+    # Library callers that never ran configure_logging() still get the default log
+    # file, as long as nothing else has configured the root logger.
+    if not _configured and not logging.getLogger().handlers:
+        configure_logging()
+
+
+class _LazyJson:
+    """
+    Log argument that defers json.dumps until the record is formatted,
+    so filtered-out log calls never pay for serialization.
+    """
+    __slots__ = ("payload",)
+
+    def __init__(self, payload):
+        self.payload = payload
+
+    def __str__(self):
+        # Serialization now happens inside the handler, so never raise from here.
+        return json.dumps(self.payload, default=str)
+
+
+# Compact JSON for stored payloads such as the audit OLD_DATA/NEW_DATA columns;
+# orjson is used when installed and the fallback writes the same compact format.
+if orjson is not None:
+    def dump_json(obj) -> str:
+        # NON_STR_KEYS stringifies int keys the way json.dumps does.
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+else:
+    def dump_json(obj) -> str:
+        return json.dumps(obj, separators=(",", ":"), ensure_ascii=False)
 
 
 def log_event(event_name: str, details: dict):
@@ -50,10 +125,11 @@ def log_event(event_name: str, details: dict):
         event_name (str): The name of the event (e.g., 'RuleCreated', 'SimulationRun').
         details (dict): A dictionary containing event details.
     """
+    _ensure_configured()
     try:
-        logger.info(f"{event_name} - {json.dumps(details)}")
+        logger.info("%s - %s", event_name, _LazyJson(details))
     except Exception as ex:
-        logger.error(f"Error logging event {event_name}: {ex}")
+        logger.error("Error logging event %s: %s", event_name, ex)
 
 
 def log_simulation_result(simulation_name: str, record_count: int, success: bool, message: str):
@@ -91,10 +167,12 @@ def log_error(module_name: str, error_message: str, exception_obj: Exception = N
     details = {"module": module_name, "error": error_message}
     if exception_obj:
         details["exception"] = str(exception_obj)
-    logger.error(f"Error in {module_name} - {json.dumps(details)}")
+    _ensure_configured()
+    logger.error("Error in %s - %s", module_name, _LazyJson(details))
 
 
 # For standalone testing:
 if __name__ == '__main__':
+    configure_logging()
     log_simulation_result("DryRunTest", record_count=200, success=True, message="Test passed with no issues.")
     log_error("advanced_logging", "This is a test error", Exception("Test exception"))
\ No newline at end of file
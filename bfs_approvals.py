@@ -1,6 +1,7 @@
 # authentication.py
 import sys
 import json
+import hmac
 import hashlib
 from datetime import datetime
 from PyQt5 import QtWidgets
@@ -9,18 +10,44 @@ from PyQt5.QtWidgets import (
 )
 from core import logger, insert_audit_log  # Import from module1 (core.py)
 
+try:
+    import bcrypt
+except ImportError:
+    bcrypt = None
+
+BCRYPT_ROUNDS = 12
+
 def hash_password(password: str) -> str:
     """
-    Returns the SHA-256 hash of the given password.
-    (In production, consider using a stronger salted hash like bcrypt.)
+    Returns a salted bcrypt hash of the given password when bcrypt is installed,
+    otherwise the legacy SHA-256 hex digest.
     """
+    if bcrypt is not None:
+        return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)).decode('ascii')
     return hashlib.sha256(password.encode('utf-8')).hexdigest()
 
+def verify_password(password: str, stored_password: str) -> bool:
+    """
+    Checks a password against a stored value in any of the supported formats:
+    bcrypt ($2a$/$2b$/$2y$), legacy SHA-256 hex (length 64) or legacy plain text.
+    All comparisons are constant-time.
+    """
+    if stored_password.startswith(("$2a$", "$2b$", "$2y$")):
+        if bcrypt is None:
+            logger.error("Stored password is a bcrypt hash but the bcrypt package is not installed.")
+            return False
+        return bcrypt.checkpw(password.encode('utf-8'), stored_password.encode('ascii'))
+    if len(stored_password) == 64:
+        input_password_hash = hashlib.sha256(password.encode('utf-8')).hexdigest()
+        return hmac.compare_digest(input_password_hash, stored_password)
+    # Assume plain-text for legacy reasons (not recommended)
+    return hmac.compare_digest(password.encode('utf-8'), stored_password.encode('utf-8'))
+
 def authenticate_user(conn, username: str, password: str) -> dict:
     """
     Authenticates a user given username and password.
     This function queries the USERS table.
-    It supports both plain-text (for backward compatibility) and hashed passwords.
+    It supports bcrypt, legacy SHA-256 and plain-text (for backward compatibility) passwords.
     Returns a dictionary with keys 'user_id', 'user_group', and 'username' on success.
     Raises a ValueError on failure.
     """
@@ -34,26 +61,18 @@ def authenticate_user(conn, username: str, password: str) -> dict:
         """, (username,))
         user = cursor.fetchone()
         if not user:
-            logger.warning(f"Authentication failed for non-existent user: {username}")
+            logger.warning("Authentication failed for non-existent user: %s", username)
             raise ValueError("Invalid credentials.")
         user_id, uname, stored_password, user_group = user
 
-        # Check if stored password is in hashed format (e.g. length 64 for SHA-256)
-        if len(stored_password) == 64:
-            input_password_hash = hash_password(password)
-            if input_password_hash != stored_password:
-                logger.warning(f"Authentication failed for user {username}: invalid hashed password.")
-                raise ValueError("Invalid credentials.")
-        else:
-            # Assume plain-text for legacy reasons (not recommended)
-            if password != stored_password:
-                logger.warning(f"Authentication failed for user {username}: invalid plain-text password.")
-                raise ValueError("Invalid credentials.")
+        if not verify_password(password, stored_password):
+            logger.warning("Authentication failed for user %s: invalid password.", username)
+            raise ValueError("Invalid credentials.")
 
-        logger.info(f"User {username} authenticated successfully.")
+        logger.info("User %s authenticated successfully.", username)
         return {"user_id": user_id, "username": uname, "user_group": user_group}
     except Exception as ex:
-        logger.error(f"Error during authentication for user {username}: {ex}")
+        logger.error("Error during authentication for user %s: %s", username, ex)
         raise
 
 class LoginDialog(QDialog):
@@ -99,6 +118,8 @@ class LoginDialog(QDialog):
             QMessageBox.warning(self, "Input Error", "Please enter both username and password.")
             return
 
+        # One timestamp per login attempt, shared by whichever audit record is written.
+        attempt_time = datetime.now().isoformat()
         try:
             user_info = authenticate_user(self.connection, username, password)
             self.user_info = user_info
@@ -110,7 +131,7 @@ class LoginDialog(QDialog):
                 record_id=user_info["user_id"],
                 actor=username,
                 old_data=None,
-                new_data={"login_time": datetime.now().isoformat()}
+                new_data={"login_time": attempt_time}
             )
             self.accept()
         except Exception as ex:
@@ -122,6 +143,6 @@ class LoginDialog(QDialog):
                 record_id=None,
                 actor=username,
                 old_data=None,
-                new_data={"error": str(ex), "attempt_time": datetime.now().isoformat()}
+                new_data={"error": str(ex), "attempt_time": attempt_time}
             )
             QMessageBox.critical(self, "Authentication Failed", str(ex))
\ No newline at end of file
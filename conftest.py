@@ -0,0 +1 @@
+# Makes the top-level modules (core, advanced_sql_parser, ...) importable from tests/.
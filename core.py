@@ -1,38 +1,88 @@
 # core.py
-import sys
 import os
-import json
-import math
-import smtplib
+import atexit
 import logging
 import logging.handlers
 import pyodbc
 import sqlparse
+import sqlparse.keywords
+from sqlparse.engine import FilterStack
 import re
-import csv
-import time
-from datetime import datetime, date, time, timedelta
-from collections import deque
-from email.mime.text import MIMEText
-
-from PyQt5 import QtWidgets
-from PyQt5.QtWidgets import (
-    QApplication, QDialog, QMessageBox, QLineEdit, QComboBox,
-    QPushButton, QLabel, QVBoxLayout, QHBoxLayout
-)
+import decimal
+import asyncio
+import functools
+import itertools
+import queue
+import threading
+from datetime import datetime, timedelta
+from collections import Counter, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from advlog import default_log_level, dump_json
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+try:
+    import sqlglot
+    from sqlglot import exp
+    _SQLGLOT_STATEMENTS = (
+        exp.Select, exp.Union, exp.Intersect, exp.Except,
+        exp.Insert, exp.Update, exp.Delete
+    )
+except ImportError:
+    sqlglot = None
+
+# The Qt classes live in core_qt so that importing core does not load PyQt5;
+# they are still importable from here (see __getattr__ at the end of the file).
+_QT_EXPORTS = frozenset(("DatabaseConnectionDialog", "SqlParseJob", "parse_sql_dependencies_async"))
 
 # -----------------------------------------------------------------------------
 # Advanced Logging Configuration (with RotatingFileHandler)
 # -----------------------------------------------------------------------------
+class FastRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """RotatingFileHandler that checks the file type once, not on every emit."""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Devices such as /dev/null must never be rotated.
+        self._is_regular_file = (not os.path.exists(self.baseFilename)
+                                 or os.path.isfile(self.baseFilename))
+
+    def shouldRollover(self, record):
+        if self.stream is None:
+            self.stream = self._open()
+        if self.maxBytes <= 0 or not self._is_regular_file:
+            return False
+        pos = self.stream.tell()
+        if not pos:
+            return False
+        return pos + len("%s\n" % self.format(record)) >= self.maxBytes
+
+
 LOG_FILENAME = 'brm_tool_enhanced.log'
 logger = logging.getLogger('BRMTool')
-logger.setLevel(logging.DEBUG)
-handler = logging.handlers.RotatingFileHandler(
+# DEBUG only when asked for: debug records are the bulk of the volume.
+logger.setLevel(default_log_level())
+handler = FastRotatingFileHandler(
     LOG_FILENAME, maxBytes=5 * 1024 * 1024, backupCount=5
 )
 formatter = logging.Formatter('%(asctime)s:%(levelname)s:%(name)s:%(message)s')
 handler.setFormatter(formatter)
-logger.addHandler(handler)
+# Callers only put records on a queue; a listener thread owns the file handler, so
+# file writes and rollover renames never run on the UI or database threads.
+log_queue = queue.SimpleQueue()
+queue_handler = logging.handlers.QueueHandler(log_queue)
+logger.addHandler(queue_handler)
+log_listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+log_listener.start()
+# Registered before the other exit hooks, so it runs after them and their log
+# records are still written.
+atexit.register(log_listener.stop)
 
 # -----------------------------------------------------------------------------
 # Email Configuration & Sender
@@ -45,313 +95,1233 @@ EMAIL_CONFIG = {
     "sender_email": "noreply@example.com"
 }
 
-def send_email_notification(subject: str, body: str, recipients: list):
-    try:
-        msg = MIMEText(body, 'plain')
-        msg['Subject'] = subject
-        msg['From'] = EMAIL_CONFIG['sender_email']
-        msg['To'] = ", ".join(recipients)
+# Mail goes through one authenticated SMTP session owned by a background sender
+# thread, so callers only pay for building the message and queueing it.
+SMTP_IDLE_CHECK = timedelta(seconds=60)
+# Built on first use and then reused: loading the CA bundle is the expensive part
+# of a TLS context.
+_smtp_tls_context = None
+_EMAIL_QUEUE = queue.Queue()
+_email_worker = None
+_email_worker_lock = threading.Lock()
+_smtp = None
+_smtp_last_used = None
+
+def _close_smtp():
+    global _smtp
+    import smtplib
+    if _smtp is not None:
+        try:
+            _smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            pass
+        _smtp = None
+
+def _smtp_session():
+    global _smtp, _smtp_last_used, _smtp_tls_context
+    # smtplib/ssl are only loaded once mail is actually sent.
+    import smtplib
+    import ssl
+    now = datetime.now()
+    if _smtp is not None and now - _smtp_last_used > SMTP_IDLE_CHECK:
+        # Servers drop idle sessions; NOOP before reusing one that sat for a while.
+        try:
+            if _smtp.noop()[0] != 250:
+                _close_smtp()
+        except (smtplib.SMTPException, OSError):
+            _close_smtp()
+    if _smtp is None:
         smtp = smtplib.SMTP(EMAIL_CONFIG['smtp_server'], EMAIL_CONFIG['smtp_port'])
-        smtp.starttls()
+        if _smtp_tls_context is None:
+            _smtp_tls_context = ssl.create_default_context()
+        smtp.starttls(context=_smtp_tls_context)
         smtp.login(EMAIL_CONFIG['smtp_username'], EMAIL_CONFIG['smtp_password'])
-        smtp.sendmail(EMAIL_CONFIG['sender_email'], recipients, msg.as_string())
-        smtp.quit()
-        logger.info(f"Email sent to {recipients}")
+        _smtp = smtp
+    _smtp_last_used = now
+    return _smtp
+
+def _deliver(recipients, message):
+    import smtplib
+    try:
+        _smtp_session().sendmail(EMAIL_CONFIG['sender_email'], recipients, message)
+    except (smtplib.SMTPServerDisconnected, ConnectionError):
+        # The session died between checks; reconnect once and retry. Other SMTP
+        # errors (refused recipients, rejected data, auth) are final: SMTPException
+        # subclasses OSError, so OSError must not be caught here.
+        _close_smtp()
+        _smtp_session().sendmail(EMAIL_CONFIG['sender_email'], recipients, message)
+
+def _email_worker_loop():
+    while True:
+        item = _EMAIL_QUEUE.get()
+        try:
+            if item is None:
+                _close_smtp()
+                return
+            recipients, message = item
+            _deliver(recipients, message)
+            logger.info("Email sent to %s", recipients)
+        except Exception as ex:
+            logger.error("Error sending email: %s", ex)
+        finally:
+            _EMAIL_QUEUE.task_done()
+
+def _ensure_email_worker():
+    global _email_worker
+    with _email_worker_lock:
+        if _email_worker is None or not _email_worker.is_alive():
+            _email_worker = threading.Thread(
+                target=_email_worker_loop, name="BRMEmailSender", daemon=True
+            )
+            _email_worker.start()
+
+def _stop_email_worker():
+    # Deliver whatever is still queued before the interpreter exits.
+    if _email_worker is not None and _email_worker.is_alive():
+        _EMAIL_QUEUE.put(None)
+        _email_worker.join(timeout=30)
+
+atexit.register(_stop_email_worker)
+
+def _build_message(subject, body, recipients):
+    from email.mime.text import MIMEText
+    msg = MIMEText(body, 'plain')
+    msg['Subject'] = subject
+    msg['From'] = EMAIL_CONFIG['sender_email']
+    msg['To'] = ", ".join(recipients)
+    return msg.as_string()
+
+def send_email_notification(subject: str, body: str, recipients: list):
+    try:
+        message = _build_message(subject, body, recipients)
+        _ensure_email_worker()
+        _EMAIL_QUEUE.put((recipients, message))
     except Exception as ex:
-        logger.error(f"Error sending email: {ex}")
+        logger.error("Error sending email: %s", ex)
+
+def send_email_batch(messages: list):
+    """
+    Queue several (subject, body, recipients) messages at once; the sender thread
+    delivers them back to back over its one SMTP session.
+    """
+    queued = 0
+    for subject, body, recipients in messages:
+        try:
+            message = _build_message(subject, body, recipients)
+        except Exception as ex:
+            logger.error("Error building email '%s': %s", subject, ex)
+            continue
+        if not queued:
+            _ensure_email_worker()
+        _EMAIL_QUEUE.put((recipients, message))
+        queued += 1
+    logger.info("Queued %s emails.", queued)
 
 # -----------------------------------------------------------------------------
-# Database Connection Dialog
+# Connection Pooling
 # -----------------------------------------------------------------------------
-class DatabaseConnectionDialog(QDialog):
-    def __init__(self, parent=None):
-        super(DatabaseConnectionDialog, self).__init__(parent)
-        self.connection = None
-        self.setWindowTitle("Database Connection")
-        self.resize(400, 200)
-        main_layout = QVBoxLayout(self)
-        
-        label = QLabel("Select ODBC DSN or provide a custom connection string:")
-        main_layout.addWidget(label)
-        
-        self.dsn_combo = QComboBox()
+# Let the ODBC driver manager reuse physical connections as well; this must be
+# set before the first pyodbc.connect() call.
+pyodbc.pooling = True
+
+POOL_MAXSIZE = 8
+# Idle connections older than this are closed instead of reused; servers and
+# firewalls drop long-idle sessions anyway.
+POOL_MAX_IDLE = timedelta(minutes=10)
+# Only connections idle longer than this are pinged before reuse; a recently used
+# one goes straight back to work, and a statement that fails on it with a
+# pyodbc.Error gets it discarded by acquire().
+POOL_PING_AFTER = timedelta(seconds=30)
+
+def _is_alive(conn):
+    try:
+        conn.cursor().execute("SELECT 1").fetchone()
+        return True
+    except pyodbc.Error:
+        return False
+
+def _close_quietly(conn):
+    try:
+        conn.close()
+    except pyodbc.Error:
+        pass
+
+class ConnectionPool:
+    """
+    LIFO pool of pyodbc connections sharing one connection string.
+    Pools opened with autocommit=True suit short metadata work (rule locks, audit
+    rows), where each statement commits on its own without a separate round trip.
+    """
+    def __init__(self, conn_str, maxsize=POOL_MAXSIZE, autocommit=False):
+        self.conn_str = conn_str
+        self.autocommit = autocommit
+        self._idle = queue.LifoQueue(maxsize=maxsize)
+
+    def get(self):
+        # Most recently returned connections are the most likely to still be open.
+        while True:
+            try:
+                conn, returned_at = self._idle.get_nowait()
+            except queue.Empty:
+                return pyodbc.connect(self.conn_str, autocommit=self.autocommit)
+            idle = datetime.now() - returned_at
+            if idle > POOL_MAX_IDLE:
+                _close_quietly(conn)
+                continue
+            if idle <= POOL_PING_AFTER or _is_alive(conn):
+                return conn
+            logger.warning("Discarding dead pooled connection.")
+            _close_quietly(conn)
+
+    def put(self, conn):
+        # Never hand an open transaction to the next borrower.
+        if not conn.autocommit:
+            try:
+                conn.rollback()
+            except pyodbc.Error:
+                _close_quietly(conn)
+                return
         try:
-            data_sources = pyodbc.dataSources()
-            for dsn, driver in data_sources.items():
-                if "SQL SERVER" in driver.upper():
-                    self.dsn_combo.addItem(f"ODBC DSN: {dsn}", dsn)
-        except Exception as e:
-            logger.error(f"Error retrieving DSNs: {e}")
-        main_layout.addWidget(self.dsn_combo)
-        
-        self.conn_str_edit = QLineEdit()
-        self.conn_str_edit.setPlaceholderText("Or enter custom connection string")
-        main_layout.addWidget(self.conn_str_edit)
-        
-        btn_layout = QHBoxLayout()
-        connect_btn = QPushButton("Connect")
-        connect_btn.clicked.connect(self.accept)
-        cancel_btn = QPushButton("Cancel")
-        cancel_btn.clicked.connect(self.reject)
-        btn_layout.addWidget(connect_btn)
-        btn_layout.addWidget(cancel_btn)
-        main_layout.addLayout(btn_layout)
-    
-    def get_connection(self):
-        override = self.conn_str_edit.text().strip()
-        if override:
-            conn_str = override
+            self._idle.put_nowait((conn, datetime.now()))
+        except queue.Full:
+            _close_quietly(conn)
+
+    def close_all(self):
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            _close_quietly(conn)
+
+    @contextmanager
+    def acquire(self):
+        conn = self.get()
+        try:
+            yield conn
+        except pyodbc.Error:
+            # The connection may be the reason the statement failed; do not reuse it.
+            _close_quietly(conn)
+            raise
+        except BaseException:
+            self.put(conn)
+            raise
+        self.put(conn)
+
+_POOLS = {}
+_POOLS_LOCK = threading.Lock()
+
+def get_pool(conn_str, autocommit=False):
+    key = (conn_str, autocommit)
+    with _POOLS_LOCK:
+        pool = _POOLS.get(key)
+        if pool is None:
+            pool = _POOLS[key] = ConnectionPool(conn_str, autocommit=autocommit)
+        return pool
+
+class ConnectionManager:
+    """
+    Lends pooled connections by connection string; release() returns a connection
+    to the pool it was taken from. Use the shared CONNECTIONS instance.
+    """
+    def __init__(self):
+        self._owners = {}
+        self._lock = threading.Lock()
+
+    def get_connection(self, conn_str, autocommit=False):
+        pool = get_pool(conn_str, autocommit)
+        conn = pool.get()
+        with self._lock:
+            self._owners[id(conn)] = pool
+        return conn
+
+    def release(self, conn):
+        with self._lock:
+            pool = self._owners.pop(id(conn), None)
+        if pool is None:
+            _close_quietly(conn)
         else:
-            dsn = self.dsn_combo.currentData()
-            if not dsn:
-                QMessageBox.critical(self, "Error", "No DSN selected.")
-                return None
-            conn_str = f"DSN={dsn};Trusted_Connection=yes;"
+            pool.put(conn)
+
+CONNECTIONS = ConnectionManager()
+get_pooled_connection = CONNECTIONS.get_connection
+release_connection = CONNECTIONS.release
+
+def _drain_pools():
+    with _POOLS_LOCK:
+        pools = list(_POOLS.values())
+    for pool in pools:
+        pool.close_all()
+
+atexit.register(_drain_pools)
+
+# Connections (by id) currently inside a transaction() block.
+_TRANSACTIONS = set()
+_TRANSACTIONS_LOCK = threading.Lock()
+
+def _in_transaction(conn):
+    return id(conn) in _TRANSACTIONS
+
+def _commit(conn):
+    # Autocommit connections have already committed each statement, and inside
+    # transaction() the commit belongs to the block.
+    if not conn.autocommit and not _in_transaction(conn):
+        conn.commit()
+
+@contextmanager
+def transaction(conn):
+    """
+    Run a multi-step workflow as one transaction:
+
+        with transaction(conn) as conn:
+            lock_rule(conn, rule_id, user)
+            insert_audit_logs(conn, entries)
+
+    The helpers skip their own commits inside the block; it commits once on exit
+    or rolls back on an exception. conn may be a ConnectionPool. Nested blocks on
+    the same connection join the outer transaction.
+    """
+    pool_key = conn.conn_str if isinstance(conn, ConnectionPool) else None
+    with _borrow(conn) as conn:
+        key = id(conn)
+        with _TRANSACTIONS_LOCK:
+            nested = key in _TRANSACTIONS
+            _TRANSACTIONS.add(key)
+        if nested:
+            yield conn
+            return
+        autocommit = conn.autocommit
+        conn.autocommit = False
         try:
-            conn = pyodbc.connect(conn_str)
-            logger.info("Database connection established.")
-            return conn
-        except Exception as e:
-            QMessageBox.critical(self, "Connection Error", str(e))
-            logger.error(f"Database connection error: {e}")
-            return None
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            # Locks taken in the block were rolled back too; forget the cached owners
+            # for this database.
+            with _LOCAL_OWNERS_LOCK:
+                for owner_key in [k for k in _LOCAL_OWNERS if k[0] in (key, pool_key)]:
+                    del _LOCAL_OWNERS[owner_key]
+            raise
+        finally:
+            conn.autocommit = autocommit
+            with _TRANSACTIONS_LOCK:
+                _TRANSACTIONS.discard(key)
+
+@contextmanager
+def _borrow(conn):
+    """Yield a connection from a ConnectionPool, or pass a plain connection through."""
+    if isinstance(conn, ConnectionPool):
+        with conn.acquire() as pooled:
+            yield pooled
+    else:
+        yield conn
+
+# pyodbc keeps a statement prepared on its cursor and skips the prepare when the
+# same SQL runs again, so the fixed statements below each keep one cursor per
+# thread and connection.
+STATEMENT_CURSOR_CACHE_SIZE = 64
+_STATEMENT_CURSORS = threading.local()
+
+def _statement_cursor(conn, sql):
+    cursors = getattr(_STATEMENT_CURSORS, "cursors", None)
+    if cursors is None:
+        cursors = _STATEMENT_CURSORS.cursors = {}
+    key = (id(conn), sql)
+    c = cursors.get(key)
+    # A new connection can reuse the id of a closed one.
+    if c is not None and c.connection is conn:
+        return c
+    c = cursors[key] = conn.cursor()
+    if len(cursors) > STATEMENT_CURSOR_CACHE_SIZE:
+        oldest = next(iter(cursors))
+        try:
+            cursors.pop(oldest).close()
+        except pyodbc.Error:
+            pass
+    return c
 
 # -----------------------------------------------------------------------------
 # Database Helper Functions
 # -----------------------------------------------------------------------------
-def fetch_all_dict(cursor):
-    rows = cursor.fetchall()
+def _column_names(description):
+    return tuple(desc[0] for desc in description)
+
+def iter_dict(cursor, arraysize=5000):
+    """Yield result rows as dicts, fetching arraysize rows per round trip."""
+    description = cursor.description
+    if not description:
+        return
+    columns = _column_names(description)
+    cursor.arraysize = arraysize
+    while True:
+        rows = cursor.fetchmany(arraysize)
+        if not rows:
+            return
+        for row in rows:
+            yield dict(zip(columns, row))
+
+def fetch_all_dict(cursor, arraysize=10000):
     if cursor.description:
-        columns = [desc[0] for desc in cursor.description]
-        return [dict(zip(columns, row)) for row in rows]
-    return rows
+        return list(iter_dict(cursor, arraysize))
+    return cursor.fetchall()
+
+@functools.lru_cache(maxsize=256)
+def _row_type(columns):
+    # One class per column signature; rename=True turns names that are not valid
+    # identifiers (duplicates, spaces, keywords) into _0, _1, ...
+    return namedtuple("Row", columns, rename=True)
+
+def fetch_all_namedtuple(cursor, arraysize=10000):
+    """Fetch all rows as namedtuples: smaller than dicts, with attribute access."""
+    description = cursor.description
+    if not description:
+        return cursor.fetchall()
+    make = _row_type(_column_names(description))._make
+    cursor.arraysize = arraysize
+    result = []
+    while True:
+        rows = cursor.fetchmany(arraysize)
+        if not rows:
+            return result
+        result.extend(map(make, rows))
 
 def fetch_one_dict(cursor):
     row = cursor.fetchone()
-    if row and cursor.description:
-        columns = [desc[0] for desc in cursor.description]
-        return dict(zip(columns, row))
+    if row:
+        description = cursor.description
+        if description:
+            return dict(zip(_column_names(description), row))
     return None
 
-def insert_audit_log(conn, action, table_name, record_id, actor, old_data, new_data):
+# pyodbc reports the Python type of each column in cursor.description[i][1].
+_NUMPY_DTYPES = {
+    int: "int64",
+    float: "float64",
+    decimal.Decimal: "float64",
+    bool: "bool"
+}
+
+def _fetch_column_lists(cursor, description, arraysize):
+    columns = _column_names(description)
+    values = [[] for _ in columns]
+    extenders = [col.extend for col in values]
+    cursor.arraysize = arraysize
+    while True:
+        rows = cursor.fetchmany(arraysize)
+        if not rows:
+            return columns, values
+        for extend, column in zip(extenders, zip(*rows)):
+            extend(column)
+
+def fetch_columnar(cursor, arraysize=10000):
+    """
+    Fetch a result set column by column as {column_name: values}.
+    With numpy installed, numeric columns become typed arrays (object arrays when the
+    column contains NULLs) and everything else object arrays; without numpy each
+    column is a plain list.
+    """
+    description = cursor.description
+    if not description:
+        return {}
+    columns, values = _fetch_column_lists(cursor, description, arraysize)
+    if np is None:
+        return dict(zip(columns, values))
+    result = {}
+    for desc, name, column in zip(description, columns, values):
+        dtype = _NUMPY_DTYPES.get(desc[1], object)
+        if dtype is not object and None in column:
+            dtype = object
+        result[name] = np.array(column, dtype=dtype)
+    return result
+
+def fetch_all_arrow(cursor, arraysize=10000):
+    """Fetch a result set as a pyarrow.Table (requires pyarrow)."""
+    if pyarrow is None:
+        raise RuntimeError("fetch_all_arrow requires pyarrow.")
+    # turbodbc cursors build the table natively.
+    if hasattr(cursor, "fetchallarrow"):
+        return cursor.fetchallarrow()
+    description = cursor.description
+    if not description:
+        return pyarrow.table({})
+    columns, values = _fetch_column_lists(cursor, description, arraysize)
+    return pyarrow.table(dict(zip(columns, values)))
+
+# -----------------------------------------------------------------------------
+# Background Database Work
+# -----------------------------------------------------------------------------
+# Long fetches and writes can run on these worker threads so the Qt event loop is
+# not blocked. A pyodbc connection must not be used by two threads at once; pass
+# a ConnectionPool to the lock/audit helpers so each call borrows its own.
+_DB_EXECUTOR = ThreadPoolExecutor(max_workers=POOL_MAXSIZE, thread_name_prefix="BRMDatabase")
+
+def submit_db(fn, *args, **kwargs):
+    """Run fn(*args, **kwargs) on a database worker thread; returns a Future."""
+    return _DB_EXECUTOR.submit(fn, *args, **kwargs)
+
+async def run_db(fn, *args, **kwargs):
+    """Await fn(*args, **kwargs) run on a database worker thread."""
+    return await asyncio.wrap_future(submit_db(fn, *args, **kwargs))
+
+# insert_audit_log writes each row immediately unless the caller opts into buffering
+# (buffered=True), where rows are written in batches. The timestamp is taken in
+# Python so buffered rows keep the time of the action rather than of the flush.
+AUDIT_FLUSH_SIZE = 500
+AUDIT_FLUSH_INTERVAL = timedelta(seconds=5)
+_AUDIT_INSERT_SQL = """
+    INSERT INTO BRM_AUDIT_LOG(
+        ACTION, TABLE_NAME, RECORD_ID, ACTION_BY,
+        OLD_DATA, NEW_DATA, ACTION_TIMESTAMP
+    )
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+# Explicit parameter types for the batched insert. fast_executemany binds whole
+# parameter arrays and otherwise infers each column's type from the first row;
+# (SQL_WVARCHAR, 0) binds the JSON payloads as NVARCHAR(MAX).
+_AUDIT_INPUT_SIZES = [
+    (pyodbc.SQL_WVARCHAR, 4000, 0),
+    (pyodbc.SQL_WVARCHAR, 4000, 0),
+    (pyodbc.SQL_WVARCHAR, 4000, 0),
+    (pyodbc.SQL_WVARCHAR, 4000, 0),
+    (pyodbc.SQL_WVARCHAR, 0, 0),
+    (pyodbc.SQL_WVARCHAR, 0, 0),
+    (pyodbc.SQL_TYPE_TIMESTAMP, 23, 3)
+]
+# Buffered rows per connection: id(conn) -> (conn, rows).
+_AUDIT_BUFFER = {}
+_AUDIT_LOCK = threading.Lock()
+
+def _audit_row(action, table_name, record_id, actor, old_data, new_data, timestamp):
+    # Every column holds one Python type (str or None) across the batch.
+    return (
+        str(action) if action is not None else None,
+        str(table_name) if table_name is not None else None,
+        str(record_id) if record_id else None,
+        str(actor) if actor is not None else None,
+        dump_json(old_data) if old_data else None,
+        dump_json(new_data) if new_data else None,
+        timestamp
+    )
+
+def _write_audit_rows(conn, chunks):
+    # chunks: iterable of row lists, each sent as one executemany. On an autocommit
+    # connection the batch runs as its own transaction, so a failed chunk leaves no
+    # partial batch. Otherwise the rows go into the transaction the caller already
+    # has open and are committed the usual way; a failure is never rolled back here,
+    # since that would also discard the caller's uncommitted work.
+    with _borrow(conn) as conn:
+        own = conn.autocommit
+        if own:
+            conn.autocommit = False
+        try:
+            c = _statement_cursor(conn, _AUDIT_INSERT_SQL)
+            c.fast_executemany = True
+            for rows in chunks:
+                c.setinputsizes(_AUDIT_INPUT_SIZES)
+                c.executemany(_AUDIT_INSERT_SQL, rows)
+            if own:
+                conn.commit()
+            else:
+                _commit(conn)
+        except Exception:
+            if own:
+                conn.rollback()
+            raise
+        finally:
+            if own:
+                conn.autocommit = True
+
+def insert_audit_logs(conn, entries):
+    """
+    Write many audit records now, as one executemany and one commit.
+    entries: iterable of (action, table_name, record_id, actor, old_data, new_data).
+    For a stream of single records use insert_audit_log(..., buffered=True), which
+    flushes every AUDIT_FLUSH_SIZE rows or AUDIT_FLUSH_INTERVAL.
+    """
+    now = datetime.now()
+    rows = [_audit_row(*entry, now) for entry in entries]
+    if not rows:
+        return
     try:
-        c = conn.cursor()
-        c.execute("""
-            INSERT INTO BRM_AUDIT_LOG(
-                ACTION, TABLE_NAME, RECORD_ID, ACTION_BY,
-                OLD_DATA, NEW_DATA, ACTION_TIMESTAMP
-            )
-            VALUES (?, ?, ?, ?, ?, ?, GETDATE())
-        """, (
-            action,
-            table_name,
-            str(record_id) if record_id else None,
-            actor,
-            json.dumps(old_data) if old_data else None,
-            json.dumps(new_data) if new_data else None
-        ))
-        conn.commit()
-        logger.info(f"Audit log inserted for action: {action} on record {record_id}.")
+        _write_audit_rows(conn, (rows,))
+        logger.info("Inserted %s audit log rows.", len(rows))
     except Exception as e:
-        logger.error(f"Error inserting audit log: {e}")
+        logger.error("Error inserting %s audit log rows: %s", len(rows), e)
+
+# fast_executemany builds the whole parameter array client-side; bulk loads send
+# it in chunks of this many rows to bound memory.
+AUDIT_BULK_CHUNK = 10000
+
+def insert_audit_logs_bulk(conn, entries, chunk_size=AUDIT_BULK_CHUNK):
+    """
+    insert_audit_logs for very large bursts: entries may be any iterable (even a
+    generator) and are serialised and sent chunk_size rows at a time, all inside
+    one transaction.
+    """
+    now = datetime.now()
+    written = [0]
+    def chunks():
+        entry_iter = iter(entries)
+        while True:
+            rows = [_audit_row(*entry, now) for entry in itertools.islice(entry_iter, chunk_size)]
+            if not rows:
+                return
+            yield rows
+            written[0] += len(rows)
+    try:
+        _write_audit_rows(conn, chunks())
+        logger.info("Bulk inserted %s audit log rows.", written[0])
+    except Exception as e:
+        logger.error("Error bulk inserting audit log rows after %s rows: %s", written[0], e)
+
+def insert_audit_log(conn, action, table_name, record_id, actor, old_data, new_data,
+                     buffered=False):
+    """
+    Write one audit row and commit it, or add it to the caller's transaction().
+    With buffered=True the row is queued instead and written with later rows every
+    AUDIT_FLUSH_SIZE rows or AUDIT_FLUSH_INTERVAL; the caller must keep conn open
+    until flush_audit_log(conn) has run.
+    """
+    try:
+        row = _audit_row(action, table_name, record_id, actor, old_data, new_data,
+                         datetime.now())
+        if not buffered:
+            _write_audit_rows(conn, ([row],))
+            logger.info("Audit log inserted for action: %s on record %s.", action, record_id)
+            return
+        with _AUDIT_LOCK:
+            rows = _AUDIT_BUFFER.setdefault(id(conn), (conn, []))[1]
+            rows.append(row)
+            due = (len(rows) >= AUDIT_FLUSH_SIZE
+                   or row[-1] - rows[0][-1] >= AUDIT_FLUSH_INTERVAL)
+        logger.info("Audit log queued for action: %s on record %s.", action, record_id)
+        if due:
+            flush_audit_log(conn)
+    except Exception as e:
+        logger.error("Error inserting audit log: %s", e)
+
+def flush_audit_log(conn=None):
+    """
+    Write buffered audit rows, one executemany and commit per connection. With conn,
+    only that connection's rows are written (e.g. before committing a transaction()
+    that should include them); the rest stay buffered. Without conn every buffer is
+    written, which is meant for interpreter exit only.
+    """
+    with _AUDIT_LOCK:
+        if conn is None:
+            batches = list(_AUDIT_BUFFER.values())
+            _AUDIT_BUFFER.clear()
+        else:
+            batch = _AUDIT_BUFFER.pop(id(conn), None)
+            if batch is None:
+                return
+            batches = [batch]
+    for batch_conn, rows in batches:
+        try:
+            _write_audit_rows(batch_conn, (rows,))
+            logger.info("Flushed %s audit log rows.", len(rows))
+        except Exception as e:
+            logger.error("Error flushing %s audit log rows: %s", len(rows), e)
+
+atexit.register(flush_audit_log)
 
 # -----------------------------------------------------------------------------
 # Locking Functions
 # -----------------------------------------------------------------------------
+# Take or refresh the lock in one statement: the lock is granted when the rule is
+# unlocked, the existing lock is stale (> 30 minutes), already ours, or force is set.
+# OUTPUT returns a row only when the lock was granted.
+_LOCK_MERGE = """
+    MERGE RULE_LOCKS WITH (HOLDLOCK) AS t
+    USING (SELECT ? AS RULE_ID, ? AS LOCKED_BY) AS s
+        ON t.RULE_ID = s.RULE_ID
+    WHEN MATCHED AND (DATEDIFF(MINUTE, t.LOCK_TIMESTAMP, GETDATE()) > 30
+                      OR t.LOCKED_BY = s.LOCKED_BY OR ? = 1)
+        THEN UPDATE SET LOCKED_BY = s.LOCKED_BY, LOCK_TIMESTAMP = GETDATE()
+    WHEN NOT MATCHED
+        THEN INSERT (RULE_ID, LOCKED_BY, LOCK_TIMESTAMP) VALUES (s.RULE_ID, s.LOCKED_BY, GETDATE())
+"""
+_LOCK_MERGE_SQL = _LOCK_MERGE + "    OUTPUT $action, inserted.LOCKED_BY;\n"
+# The audited variants write the audit row from an OUTPUT ... INTO clause of the
+# same statement, so the lock change and its audit row commit or fail together in
+# a single round trip. The first parameter is the audit ACTION.
+_AUDIT_OUTPUT_INTO = """
+    INTO BRM_AUDIT_LOG(ACTION, TABLE_NAME, RECORD_ID, ACTION_BY,
+                       OLD_DATA, NEW_DATA, ACTION_TIMESTAMP)
+"""
+_LOCK_AUDIT_SQL = (
+    _LOCK_MERGE
+    + "    OUTPUT ?, 'RULE_LOCKS', CAST(inserted.RULE_ID AS NVARCHAR(50)), inserted.LOCKED_BY,"
+    + " NULL, NULL, GETDATE()"
+    + _AUDIT_OUTPUT_INTO
+    + "    OUTPUT $action, inserted.LOCKED_BY;\n"
+)
+_LOCK_OWNER_SQL = "SELECT LOCKED_BY FROM RULE_LOCKS WHERE RULE_ID=?"
+
+# Locks this process already holds, as (database, rule_id) -> (locked_by, acquired_at),
+# where database is a pool's connection string or the id() of a plain connection. A
+# repeat lock_rule for the same owner and database is answered from here without a
+# round trip. The entry lives only a few seconds, which absorbs the repeat calls of
+# one save without hiding a force lock by another user for longer than that:
+# after LOCAL_LOCK_TTL the next lock_rule asks the database again.
+LOCAL_LOCK_TTL = timedelta(seconds=5)
+_LOCAL_OWNERS = {}
+_LOCAL_OWNERS_LOCK = threading.Lock()
+
+def _lock_key(conn, rule_id):
+    return (conn.conn_str if isinstance(conn, ConnectionPool) else id(conn), rule_id)
+
 def lock_rule(conn, rule_id, locked_by, force=False):
+    now = datetime.now()
+    if not force:
+        with _LOCAL_OWNERS_LOCK:
+            owner = _LOCAL_OWNERS.get(_lock_key(conn, rule_id))
+        if owner and owner[0] == locked_by and now - owner[1] < LOCAL_LOCK_TTL:
+            return
+    _acquire_lock(conn, _LOCK_MERGE_SQL, (rule_id, locked_by, 1 if force else 0),
+                  rule_id, locked_by, now)
+
+def lock_rule_and_audit(conn, rule_id, locked_by, force=False):
+    """lock_rule that also writes a LOCK (or FORCE_LOCK) audit row in the same statement."""
+    action = "FORCE_LOCK" if force else "LOCK"
+    _acquire_lock(conn, _LOCK_AUDIT_SQL, (rule_id, locked_by, 1 if force else 0, action),
+                  rule_id, locked_by, datetime.now())
+
+def _acquire_lock(conn, sql, params, rule_id, locked_by, now):
+    key = _lock_key(conn, rule_id)
     try:
-        c = conn.cursor()
-        # Auto-release locks older than 30 minutes
-        c.execute("DELETE FROM RULE_LOCKS WHERE DATEDIFF(MINUTE, LOCK_TIMESTAMP, GETDATE()) > 30")
-        conn.commit()
-        c.execute("SELECT LOCKED_BY FROM RULE_LOCKS WHERE RULE_ID=?", (rule_id,))
-        row = c.fetchone()
-        if row:
-            current_lock = row[0]
-            if current_lock != locked_by and not force:
+        with _borrow(conn) as conn:
+            c = _statement_cursor(conn, sql)
+            c.execute(sql, params)
+            granted = c.fetchone()
+            _commit(conn)
+            if granted is None:
+                # Only the conflict path pays for a second round trip, to name the owner.
+                c = _statement_cursor(conn, _LOCK_OWNER_SQL)
+                c.execute(_LOCK_OWNER_SQL, (rule_id,))
+                row = c.fetchone()
+                current_lock = row[0] if row else "another user"
                 raise ValueError(f"Rule {rule_id} is locked by {current_lock}.")
-            else:
-                c.execute("DELETE FROM RULE_LOCKS WHERE RULE_ID=?", (rule_id,))
-        c.execute("INSERT INTO RULE_LOCKS(RULE_ID, LOCKED_BY, LOCK_TIMESTAMP) VALUES (?, ?, GETDATE())", (rule_id, locked_by))
-        conn.commit()
-        logger.info(f"Rule {rule_id} locked by {locked_by}.")
+        with _LOCAL_OWNERS_LOCK:
+            _LOCAL_OWNERS[key] = (locked_by, now)
+        logger.info("Rule %s locked by %s.", rule_id, locked_by)
     except Exception as e:
-        logger.error(f"Error locking rule {rule_id}: {e}")
+        logger.error("Error locking rule %s: %s", rule_id, e)
         raise
 
+# Release the lock only when it is ours or force is set.
+_UNLOCK_WHERE = "WHERE RULE_ID=? AND (LOCKED_BY=? OR ?=1)"
+_UNLOCK_SQL = "DELETE FROM RULE_LOCKS " + _UNLOCK_WHERE
+# Parameters: audit ACTION, ACTION_BY, then the _UNLOCK_WHERE parameters.
+_UNLOCK_AUDIT_SQL = (
+    "DELETE FROM RULE_LOCKS\n"
+    + "    OUTPUT ?, 'RULE_LOCKS', CAST(deleted.RULE_ID AS NVARCHAR(50)), ?, NULL, NULL, GETDATE()"
+    + _AUDIT_OUTPUT_INTO
+    + "    " + _UNLOCK_WHERE + "\n"
+)
+
 def unlock_rule(conn, rule_id, locked_by, force=False):
+    _release_lock(conn, _UNLOCK_SQL, (rule_id, locked_by, 1 if force else 0),
+                  rule_id, locked_by)
+
+def unlock_rule_and_audit(conn, rule_id, locked_by, force=False):
+    """unlock_rule that also writes an UNLOCK (or FORCE_UNLOCK) audit row in the same statement."""
+    action = "FORCE_UNLOCK" if force else "UNLOCK"
+    _release_lock(conn, _UNLOCK_AUDIT_SQL,
+                  (action, locked_by, rule_id, locked_by, 1 if force else 0),
+                  rule_id, locked_by)
+
+def _release_lock(conn, sql, params, rule_id, locked_by):
+    with _LOCAL_OWNERS_LOCK:
+        _LOCAL_OWNERS.pop(_lock_key(conn, rule_id), None)
     try:
-        c = conn.cursor()
-        c.execute("SELECT LOCKED_BY FROM RULE_LOCKS WHERE RULE_ID=?", (rule_id,))
-        row = c.fetchone()
-        if row and row[0] != locked_by and not force:
-            raise ValueError(f"Cannot unlock rule {rule_id}; it is locked by {row[0]}.")
-        c.execute("DELETE FROM RULE_LOCKS WHERE RULE_ID=?", (rule_id,))
-        conn.commit()
-        logger.info(f"Rule {rule_id} unlocked by {locked_by}.")
+        with _borrow(conn) as conn:
+            c = _statement_cursor(conn, sql)
+            c.execute(sql, params)
+            deleted = c.rowcount
+            _commit(conn)
+            if deleted == 0:
+                # Nothing deleted: either the rule was not locked or someone else holds it.
+                c = _statement_cursor(conn, _LOCK_OWNER_SQL)
+                c.execute(_LOCK_OWNER_SQL, (rule_id,))
+                row = c.fetchone()
+                if row:
+                    raise ValueError(f"Cannot unlock rule {rule_id}; it is locked by {row[0]}.")
+        logger.info("Rule %s unlocked by %s.", rule_id, locked_by)
     except Exception as e:
-        logger.error(f"Error unlocking rule {rule_id}: {e}")
+        logger.error("Error unlocking rule %s: %s", rule_id, e)
         raise
 
+# Stale rows never block lock_rule (the MERGE takes them over), so deleting them
+# is housekeeping that runs off the interactive path.
+LOCK_PURGE_INTERVAL = 300.0
+_PURGE_LOCKS_SQL = "DELETE FROM RULE_LOCKS WHERE DATEDIFF(MINUTE, LOCK_TIMESTAMP, GETDATE()) > 30"
+
+def purge_stale_locks(conn):
+    try:
+        with _borrow(conn) as conn:
+            c = _statement_cursor(conn, _PURGE_LOCKS_SQL)
+            c.execute(_PURGE_LOCKS_SQL)
+            purged = c.rowcount
+            _commit(conn)
+        if purged > 0:
+            logger.info("Purged %s stale rule locks.", purged)
+    except Exception as e:
+        logger.error("Error purging stale rule locks: %s", e)
+
+def start_lock_purger(conn, interval=LOCK_PURGE_INTERVAL):
+    """
+    Call purge_stale_locks(conn) every interval seconds on a daemon thread; pass a
+    ConnectionPool so the purger never shares a connection with the UI thread.
+    Returns an Event; set it to stop the purger.
+    """
+    stop = threading.Event()
+    def run():
+        while not stop.wait(interval):
+            purge_stale_locks(conn)
+    threading.Thread(target=run, name="BRMLockPurger", daemon=True).start()
+    return stop
+
 # -----------------------------------------------------------------------------
 # Utility Function: Detect Operation Type
 # -----------------------------------------------------------------------------
+# One anchored match finds the leading keyword without copying the statement (no
+# strip() or upper() of what may be a very large SQL text). Like the prefix test
+# it replaces, it does not require a word boundary after the keyword.
+_OPERATION_RE = re.compile(r"\s*(INSERT|UPDATE|DELETE|SELECT)", re.I)
+
 def detect_operation_type(rule_sql: str, decision_table_id=None) -> str:
-    if (not rule_sql.strip()) and decision_table_id:
+    m = _OPERATION_RE.match(rule_sql)
+    if m:
+        return m.group(1).upper()
+    if decision_table_id and (not rule_sql or rule_sql.isspace()):
         return "DECISION_TABLE"
-    txt = rule_sql.strip().upper()
-    if txt.startswith("INSERT"):
-        return "INSERT"
-    elif txt.startswith("UPDATE"):
-        return "UPDATE"
-    elif txt.startswith("DELETE"):
-        return "DELETE"
-    elif txt.startswith("SELECT"):
-        return "SELECT"
     return "OTHER"
 
 # -----------------------------------------------------------------------------
 # Advanced SQL Parsing using sqlparse
 # -----------------------------------------------------------------------------
+# SQL longer than this is parsed without caching, so a single huge script cannot
+# pin its text and token results in the cache.
+PARSE_CACHE_MAX_SQL = 200_000
+
 def parse_sql_dependencies(sql_text: str):
+    # The parse is cached per SQL text; fresh containers are built on every call
+    # so callers may mutate the result without touching the cache.
     try:
-        statements = sqlparse.parse(sql_text)
-        tables = []
-        cte_tables = {}
-        alias_map = {}
-        columns = []
-        for stmt in statements:
-            # Extract WITH clauses (CTEs)
-            cte_info = _extract_with_clauses(stmt)
-            cte_tables.update(cte_info)
-            # Extract main tables from FROM clause
-            main_tables, main_alias = _extract_main_from(stmt.tokens, set(cte_info.keys()))
-            tables.extend(main_tables)
-            alias_map.update(main_alias)
-            # Extract columns from SELECT clause
-            cols = _extract_columns(stmt)
-            columns.extend(cols)
-        unique_tables = list(set(tables))
+        # Surrounding whitespace never changes the result, so it is not part of the key.
+        key = sql_text.strip()
+        if len(key) > PARSE_CACHE_MAX_SQL:
+            parsed = _parse_sql_dependencies_cached.__wrapped__(key)
+        else:
+            parsed = _parse_sql_dependencies_cached(key)
+        tables, cte_items, alias_items, columns, graph = parsed
         return {
-            "tables": unique_tables,
-            "cte_tables": cte_tables,
-            "alias_map": alias_map,
-            "columns": columns
+            "tables": list(tables),
+            "cte_tables": {name: list(refs) for name, refs in cte_items},
+            "alias_map": dict(alias_items),
+            "columns": list(columns),
+            "graph": {node: list(children) for node, children in graph}
         }
     except Exception as e:
-        logger.error(f"Error parsing SQL dependencies: {e}")
-        return {"tables": [], "cte_tables": {}, "alias_map": {}, "columns": []}
-
-def _extract_with_clauses(statement):
-    cte_map = {}
-    tokens = list(statement.tokens)
-    i = 0
-    while i < len(tokens):
-        token = tokens[i]
-        if token.ttype == sqlparse.tokens.Keyword and token.value.upper() == "WITH":
-            i += 1
-            i = _parse_cte_block(tokens, i, cte_map)
-            break
-        i += 1
-    return cte_map
-
-def _parse_cte_block(tokens, i, cte_map):
-    while i < len(tokens):
-        token = tokens[i]
-        if token.ttype == sqlparse.tokens.Keyword and token.value.upper() in ("SELECT", "INSERT", "UPDATE", "DELETE"):
-            return i
-        if isinstance(token, sqlparse.sql.Identifier):
-            cte_name = token.get_real_name()
-            i += 1
-            i = _parse_cte_as_clause(tokens, i, cte_name, cte_map)
-        else:
-            i += 1
-    return i
-
-def _parse_cte_as_clause(tokens, i, cte_name, cte_map):
-    while i < len(tokens):
-        token = tokens[i]
-        if token.value.upper() == "AS":
-            i += 1
-            if i < len(tokens) and isinstance(tokens[i], sqlparse.sql.Parenthesis):
-                subselect = tokens[i]
-                sub_deps = _extract_subselect_tokens(subselect.tokens)
-                cte_map[cte_name] = sub_deps
-                i += 1
-                return i
-        i += 1
-    return i
+        logger.error("Error parsing SQL dependencies: %s", e)
+        return {"tables": [], "cte_tables": {}, "alias_map": {}, "columns": [], "graph": {}}
+
+# Shared grouping pipeline: FilterStack.run() keeps no per-call state, so one stack
+# serves every parse and statements are consumed as they are split off.
+_FILTER_STACK = FilterStack()
+_FILTER_STACK.enable_grouping()
+
+# How many uncached parses each path answered; logged at DEBUG every
+# PARSE_STATS_LOG_EVERY parses to show the regex fast path's hit rate.
+PARSE_STATS_LOG_EVERY = 1000
+_PARSE_PATH_COUNTS = Counter()
+
+@functools.lru_cache(maxsize=4096)
+def _parse_sql_dependencies_cached(sql_text):
+    parsed = _parse_flat_sql(sql_text)
+    path = "flat"
+    if parsed is None and sqlglot is not None:
+        try:
+            parsed = _parse_with_sqlglot(sql_text)
+            path = "sqlglot"
+        except Exception as e:
+            logger.debug("sqlglot could not parse SQL, falling back to sqlparse: %s", e)
+    if parsed is None:
+        parsed = _parse_with_sqlparse(sql_text)
+        path = "sqlparse"
+    _PARSE_PATH_COUNTS[path] += 1
+    total = sum(_PARSE_PATH_COUNTS.values())
+    if total % PARSE_STATS_LOG_EVERY == 0:
+        logger.debug("SQL parse paths after %s parses: %s", total, dict(_PARSE_PATH_COUNTS))
+    return parsed + (_dependency_graph(parsed[0], parsed[1]),)
+
+parse_sql_dependencies.cache_clear = _parse_sql_dependencies_cached.cache_clear
+parse_sql_dependencies.path_counts = _PARSE_PATH_COUNTS
+
+def invalidate_sql_parse_cache():
+    """Drop every cached parse and reset the parse path counters (mainly for tests)."""
+    _parse_sql_dependencies_cached.cache_clear()
+    _PARSE_PATH_COUNTS.clear()
+
+# Graph node standing for the statement's outer query.
+GRAPH_ROOT = "__root__"
+
+def _dependency_graph(tables, cte_items):
+    # Adjacency of what each query block reads: GRAPH_ROOT -> outer-query tables and
+    # CTEs, each CTE -> the tables/CTEs its body reads. Tables are "schema.name".
+    # SQL scoping only lets a CTE see earlier CTEs or itself, so the one possible cycle
+    # is a recursive CTE's self-reference, which is not recorded as an edge.
+    cte_names = {name.upper(): name for name, _ in cte_items if name}
+
+    def node(schema, name):
+        if name.startswith("(CTE) "):
+            return name[len("(CTE) "):]
+        if name.upper() in cte_names:
+            return cte_names[name.upper()]
+        return f"{schema}.{name}" if schema else name
+
+    graph = {GRAPH_ROOT: {node(schema, name) for schema, name, _ in tables if name}}
+    for cte_name, refs in cte_items:
+        graph[cte_name] = {node(schema, name) for schema, name, _ in refs if name} - {cte_name}
+    return tuple((parent, tuple(sorted(children))) for parent, children in graph.items())
+
+def _parse_with_sqlparse(sql_text):
+    # Tables are a dict used as an insertion-ordered set: deduplicated as they are
+    # found and reported in first-seen order.
+    tables = {}
+    cte_tables = {}
+    alias_map = {}
+    columns = []
+    for stmt in _FILTER_STACK.run(sql_text):
+        # CTEs, tables from FROM/JOIN and columns from SELECT lists, in one walk
+        for kind, payload in _walk_statement(stmt.tokens):
+            if kind == "TABLE":
+                tables[payload] = None
+                if payload[2]:
+                    alias_map[payload[2]] = (payload[0], payload[1])
+            elif kind == "COLUMN":
+                columns.append(payload)
+            else:
+                cte_tables[payload[0]] = payload[1]
+    return (
+        tuple(tables),
+        tuple((name, tuple(refs)) for name, refs in cte_tables.items()),
+        tuple(alias_map.items()),
+        tuple(columns)
+    )
+
+def _parse_with_sqlglot(sql_text):
+    # Same result tuple as the sqlparse walk, read from sqlglot's T-SQL AST. Raises
+    # on anything sqlglot cannot fully parse so the caller falls back to sqlparse.
+    tables = {}
+    cte_tables = {}
+    alias_map = {}
+    columns = []
+    for stmt in sqlglot.parse(sql_text, read="tsql"):
+        if stmt is None:
+            continue
+        if not isinstance(stmt, _SQLGLOT_STATEMENTS):
+            # EXEC, DDL and raw commands are only kept as text by sqlglot.
+            raise ValueError(f"Unsupported statement type: {type(stmt).__name__}")
+        _require_sqlparse_shape(stmt)
+        cte_names = set()
+        for cte in stmt.find_all(exp.CTE):
+            cte_name = cte.alias_or_name
+            cte_names.add(cte_name.upper())
+            cte_tables[cte_name] = [(tbl.db or None, tbl.name, tbl.alias or None)
+                                    for tbl in cte.this.find_all(exp.Table)]
+        skip = set()
+        if isinstance(stmt, (exp.Insert, exp.Update)):
+            # Write targets are not read dependencies.
+            skip.update(id(tbl) for tbl in stmt.this.find_all(exp.Table))
+        for tbl in stmt.find_all(exp.Table):
+            if id(tbl) in skip or tbl.find_ancestor(exp.CTE) is not None:
+                continue
+            alias = tbl.alias or None
+            if tbl.name.upper() in cte_names:
+                ref = (None, f"(CTE) {tbl.name}", alias)
+            else:
+                ref = (tbl.db or None, tbl.name, alias)
+            tables[ref] = None
+            if alias:
+                alias_map[alias] = (ref[0], ref[1])
+        for query in _sqlglot_top_level_selects(stmt):
+            for projection in query.expressions:
+                # Plain and aliased columns only, as Identifier.get_name() reports them.
+                if isinstance(projection, (exp.Column, exp.Alias)):
+                    name = projection.alias_or_name
+                    if name and name != "*":
+                        columns.append(name)
+    return (
+        tuple(tables),
+        tuple((name, tuple(refs)) for name, refs in cte_tables.items()),
+        tuple(alias_map.items()),
+        tuple(columns)
+    )
+
+def _require_sqlparse_shape(stmt):
+    # Only statements both paths read the same way are answered from the AST. The
+    # sqlparse walk keeps bracketed/quoted names and #temp/@variable prefixes
+    # verbatim, reports a derived table by its alias, ignores WHERE subqueries and
+    # SELECT INTO targets, skips table-valued functions, lists TOP and qualified stars
+    # as columns, takes a table name followed by a comment as its own alias and keeps
+    # the first two parts of db.schema.table. sqlglot would differ on each, so raise
+    # and let the caller fall back to sqlparse.
+    selects = {id(query) for query in _sqlglot_top_level_selects(stmt)}
+    for cte in stmt.find_all(exp.CTE):
+        selects.update(id(query) for query in _sqlglot_top_level_selects(cte.this))
+    for node in stmt.walk():
+        if node.comments:
+            raise ValueError("Comment")
+        if isinstance(node, exp.Identifier) and (
+                node.quoted or node.args.get("temporary") or node.args.get("global_")):
+            raise ValueError("Quoted or temporary-table identifier")
+        if isinstance(node, exp.Subquery) or (
+                isinstance(node, exp.Select) and id(node) not in selects):
+            raise ValueError("Subquery")
+        if isinstance(node, (exp.Limit, exp.Fetch)):
+            raise ValueError("TOP/FETCH clause")
+        if isinstance(node, exp.Into):
+            raise ValueError("SELECT INTO")
+        if isinstance(node, exp.Table):
+            if not isinstance(node.this, exp.Identifier):
+                raise ValueError("Table variable or table-valued function")
+            if node.args.get("catalog") is not None:
+                raise ValueError("Three-part table name")
+    for query in _sqlglot_top_level_selects(stmt):
+        for projection in query.expressions:
+            if not isinstance(projection, (exp.Column, exp.Alias, exp.Star)):
+                raise ValueError(f"Unsupported projection: {type(projection).__name__}")
+            if projection.is_star and (isinstance(projection, exp.Column)
+                                       or len(query.expressions) > 1):
+                raise ValueError("Star in a select list")
+
+def _sqlglot_top_level_selects(stmt):
+    # SELECTs at statement level: set-operation branches and the SELECT feeding an
+    # INSERT count, subqueries and CTE bodies do not.
+    pending = [stmt]
+    while pending:
+        node = pending.pop(0)
+        if isinstance(node, exp.Select):
+            yield node
+        elif isinstance(node, (exp.Union, exp.Intersect, exp.Except)):
+            pending.extend(child for child in (node.left, node.right) if child is not None)
+        elif isinstance(node, exp.Insert) and node.expression is not None:
+            pending.append(node.expression)
+
+# -----------------------------------------------------------------------------
+# Regex fast path for flat single-table-list statements
+# -----------------------------------------------------------------------------
+# Handles "SELECT [DISTINCT] cols FROM tables [WHERE/GROUP/ORDER/HAVING ...]" and
+# "DELETE FROM tables [WHERE ...]" with no parentheses, quotes, comments, joins or
+# keyword-like names; anything else returns None and goes through sqlparse, which
+# yields exactly the same result for the statements accepted here.
+_NAME = r"[A-Za-z_][A-Za-z0-9_]*"
+_FLAT_REJECT_RE = re.compile(r"[()'\"\[\]`@#$]|--|/\*|;\s*\S")
+_FLAT_STATEMENT_RE = re.compile(
+    r"\s*(?:SELECT\s+(?:DISTINCT\s+)?(?P<cols>.+?)|DELETE)\s+FROM\s+(?P<tables>.+?)"
+    r"(?:\s+(?P<tail>(?:WHERE|GROUP|ORDER|HAVING)\b.*?))?\s*;?\s*\Z",
+    re.I | re.S
+)
+_FLAT_ITEM_RE = re.compile(
+    rf"({_NAME})(?:\.({_NAME}))?(?:\s+(?:AS\s+)?({_NAME}))?\Z", re.I
+)
+_FLAT_TAIL_REJECT_RE = re.compile(r"\b(?:SELECT|FROM|JOIN|UNION|INTERSECT|EXCEPT|INTO|WITH)\b", re.I)
+_SQL_KEYWORDS = frozenset().union(*(
+    words for name, words in vars(sqlparse.keywords).items()
+    if name.startswith("KEYWORDS") and isinstance(words, dict)
+))
+
+def _split_flat_items(text):
+    items = []
+    for part in text.split(","):
+        m = _FLAT_ITEM_RE.match(part.strip())
+        if not m or any(n and n.upper() in _SQL_KEYWORDS for n in m.groups()):
+            return None
+        items.append(m.groups())
+    return items
+
+def _parse_flat_sql(sql_text):
+    if _FLAT_REJECT_RE.search(sql_text):
+        return None
+    m = _FLAT_STATEMENT_RE.match(sql_text)
+    if not m or (m.group("tail") and _FLAT_TAIL_REJECT_RE.search(m.group("tail"))):
+        return None
+    table_items = _split_flat_items(m.group("tables"))
+    if table_items is None:
+        return None
+    columns = []
+    cols = m.group("cols")
+    if cols is not None and cols.strip() != "*":
+        col_items = _split_flat_items(cols)
+        if col_items is None:
+            return None
+        # Identifier.get_name(): the alias if present, else the (unqualified) name.
+        columns = [alias or (col or qualifier) for qualifier, col, alias in col_items]
+    tables = {}
+    alias_map = {}
+    for first, second, alias in table_items:
+        schema, name = (first, second) if second else (None, first)
+        tables[(schema, name, alias)] = None
+        if alias:
+            alias_map[alias] = (schema, name)
+    return (tuple(tables), (), tuple(alias_map.items()), tuple(columns))
+
+# States of the WITH-clause scanner in _cte_definitions.
+_CTE_INIT, _CTE_AFTER_WITH, _CTE_AWAIT_AS, _CTE_AWAIT_PAREN = range(4)
+
+def _cte_definitions(token, scan):
+    # Advances the WITH-clause state machine (WITH -> CTE name -> AS -> (body) -> next
+    # CTE ...) over one top-level token, yielding (name, refs) for each CTE body it
+    # completes. scan is [state, current CTE name] and persists across tokens. CTE
+    # identifiers and identifier lists are walked in place via a stack of iterators.
+    stack = [iter((token,))]
+    while stack:
+        token = next(stack[-1], None)
+        if token is None:
+            stack.pop()
+            continue
+        ttype = token.ttype
+        if ttype in sqlparse.tokens.DML:
+            scan[0] = _CTE_INIT
+            return
+        state = scan[0]
+        if state == _CTE_AFTER_WITH:
+            if isinstance(token, sqlparse.sql.IdentifierList):
+                stack.append(iter(token.tokens))
+            elif isinstance(token, sqlparse.sql.Identifier):
+                scan[0] = _CTE_AWAIT_AS
+                scan[1] = token.get_real_name()
+                # The first child is the name (or name plus column list); skip it.
+                stack.append(iter(token.tokens[1:]))
+        elif state == _CTE_AWAIT_AS:
+            if ttype in sqlparse.tokens.Keyword and token.normalized == "AS":
+                scan[0] = _CTE_AWAIT_PAREN
+        elif state == _CTE_AWAIT_PAREN and isinstance(token, sqlparse.sql.Parenthesis):
+            yield (scan[1], list(_extract_subselect_tokens(token.tokens)))
+            scan[0] = _CTE_AFTER_WITH
+
+# The scanners below test token classes with "type(token) is ...": sqlparse has no
+# subclasses of Identifier or IdentifierList, and an identity test is cheaper than
+# isinstance in these per-token loops.
+# Keyword sets for the scanners below. They are matched against token.normalized,
+# which sqlparse already uppercases for keywords, so no per-token upper() is needed.
+# sqlparse lexes every join spelling as one keyword token, so all of them are listed.
+_FROM_KEYWORDS = frozenset({
+    "FROM", "JOIN", "INNER JOIN", "LEFT JOIN", "RIGHT JOIN", "FULL JOIN", "CROSS JOIN",
+    "LEFT OUTER JOIN", "RIGHT OUTER JOIN", "FULL OUTER JOIN"
+})
+_SELECT_TERMINATORS = frozenset({
+    "FROM", "JOIN", "WHERE", "GROUP", "GROUP BY", "ORDER", "ORDER BY",
+    "UNION", "INTERSECT", "HAVING", "LIMIT"
+})
+_NO_CTES = frozenset()
 
 def _extract_subselect_tokens(tokens):
-    results = []
+    # Yields (schema, name, alias) for each identifier in a FROM/JOIN clause; any
+    # other keyword (WHERE, GROUP BY, ORDER BY, UNION, ...) closes the clause.
+    # Hot loop: bind attribute/global lookups to locals once.
+    parse_identifier = _parse_identifier
+    Keyword = sqlparse.tokens.Keyword
+    Identifier = sqlparse.sql.Identifier
+    IdentifierList = sqlparse.sql.IdentifierList
     from_seen = False
     for token in tokens:
-        if token.ttype == sqlparse.tokens.Keyword and token.value.upper() in ("FROM", "JOIN"):
-            from_seen = True
+        if token.ttype is Keyword:
+            from_seen = token.normalized in _FROM_KEYWORDS
         if from_seen:
-            if isinstance(token, sqlparse.sql.IdentifierList):
+            cls = type(token)
+            if cls is IdentifierList:
                 for ident in token.get_identifiers():
-                    results.append(_parse_identifier(ident, set()))
-            elif isinstance(token, sqlparse.sql.Identifier):
-                results.append(_parse_identifier(token, set()))
-    return results
+                    yield parse_identifier(ident, _NO_CTES)
+            elif cls is Identifier:
+                yield parse_identifier(token, _NO_CTES)
 
-def _extract_main_from(tokens, known_cte):
-    results = []
-    alias_map = {}
+def _walk_statement(tokens):
+    # One pass over the statement's top-level tokens, yielding ("CTE", (name, refs)) for
+    # each CTE of a leading WITH clause, ("TABLE", (schema, name, alias)) for FROM/JOIN
+    # targets and ("COLUMN", name) for SELECT-list items.
+    # CTE definitions all precede the statement's first DML keyword, so every CTE name
+    # is known before the first table reference that could point at it.
+    # A SELECT list runs until a _SELECT_TERMINATORS keyword; lists still open when another
+    # SELECT starts keep collecting, and are emitted in SELECT order when they close.
+    # Hot loop: bind attribute/global lookups to locals once.
+    Keyword = sqlparse.tokens.Keyword
+    DML = sqlparse.tokens.DML
+    Identifier = sqlparse.sql.Identifier
+    IdentifierList = sqlparse.sql.IdentifierList
+    parse_identifier = _parse_identifier
+    known_cte = set()
+    cte_scan = None
+    dml_seen = False
     from_seen = False
+    select_lists = []
     for token in tokens:
-        if token.ttype == sqlparse.tokens.Keyword:
-            if token.value.upper() in ("FROM", "JOIN"):
-                from_seen = True
+        ttype = token.ttype
+        if cte_scan is not None:
+            if ttype == DML:
+                cte_scan = None
             else:
-                from_seen = False
+                for name, refs in _cte_definitions(token, cte_scan):
+                    if name:
+                        known_cte.add(name.upper())
+                    yield ("CTE", (name, refs))
+                if cte_scan[0] == _CTE_INIT:
+                    cte_scan = None
+                continue
+        elif not dml_seen and ttype in Keyword and token.normalized == "WITH":
+            # WITH is lexed as Keyword.CTE, hence the subtype test.
+            cte_scan = [_CTE_AFTER_WITH, None]
+            continue
+        if ttype == Keyword:
+            normalized = token.normalized
+            from_seen = normalized in _FROM_KEYWORDS
+            if select_lists and normalized in _SELECT_TERMINATORS:
+                for names in select_lists:
+                    for name in names:
+                        yield ("COLUMN", name)
+                select_lists = []
+            continue
+        if ttype == DML:
+            dml_seen = True
+            if token.normalized == "SELECT":
+                select_lists.append([])
+            continue
+        cls = type(token)
+        if cls is IdentifierList:
+            if not (from_seen or select_lists):
+                continue
+            idents = list(token.get_identifiers())
+        elif cls is Identifier:
+            idents = (token,)
+        else:
+            continue
         if from_seen:
-            if isinstance(token, sqlparse.sql.IdentifierList):
-                for ident in token.get_identifiers():
-                    res = _parse_identifier(ident, known_cte)
-                    results.append(res)
-                    if res[2]:
-                        alias_map[res[2]] = (res[0], res[1])
-            elif isinstance(token, sqlparse.sql.Identifier):
-                res = _parse_identifier(token, known_cte)
-                results.append(res)
-                if res[2]:
-                    alias_map[res[2]] = (res[0], res[1])
-    return results, alias_map
+            for ident in idents:
+                yield ("TABLE", parse_identifier(ident, known_cte))
+        if select_lists:
+            names = [name for name in (ident.get_name() for ident in idents) if name]
+            for open_list in select_lists:
+                open_list.extend(names)
+    for names in select_lists:
+        for name in names:
+            yield ("COLUMN", name)
 
 def _parse_identifier(ident, known_cte):
+    # known_cte holds upper-cased CTE names.
     alias = ident.get_alias()
     real_name = ident.get_real_name()
     schema = ident.get_parent_name()
-    if real_name and any(real_name.upper() == name.upper() for name in known_cte):
+    if real_name and real_name.upper() in known_cte:
         return (None, f"(CTE) {real_name}", alias)
     return (schema, real_name, alias)
 
-def _extract_columns(statement):
-    results = []
-    for token in statement.tokens:
-        if token.ttype == sqlparse.tokens.DML and token.value.upper() == "SELECT":
-            idx = statement.token_index(token) + 1
-            results.extend(_parse_select_list(statement.tokens, idx))
-    return results
-
-def _parse_select_list(tokens, idx):
-    columns = []
-    while idx < len(tokens):
-        token = tokens[idx]
-        if token.ttype == sqlparse.tokens.Keyword and token.value.upper() in ("FROM", "WHERE", "GROUP", "ORDER"):
-            break
-        if isinstance(token, sqlparse.sql.IdentifierList):
-            for ident in token.get_identifiers():
-                col = ident.get_name()
-                if col:
-                    columns.append(col)
-        elif isinstance(token, sqlparse.sql.Identifier):
-            col = token.get_name()
-            if col:
-                columns.append(col)
-        idx += 1
-    return columns
+def __getattr__(name):
+    if name in _QT_EXPORTS:
+        import core_qt
+        return getattr(core_qt, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # End of core.py
\ No newline at end of file
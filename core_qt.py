@@ -0,0 +1,102 @@
+# core_qt.py
+# Qt parts of core: the connection dialog and background SQL parsing. Kept apart
+# so that importing core does not load PyQt5; core re-exports these names lazily.
+import re
+import pyodbc
+
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+from PyQt5.QtWidgets import (
+    QDialog, QMessageBox, QLineEdit, QComboBox,
+    QPushButton, QLabel, QVBoxLayout, QHBoxLayout
+)
+
+from core import logger, get_pool, CONNECTIONS, parse_sql_dependencies
+
+# -----------------------------------------------------------------------------
+# Database Connection Dialog
+# -----------------------------------------------------------------------------
+_SQLSERVER_RE = re.compile(r"SQL ?SERVER", re.I)
+
+class DatabaseConnectionDialog(QDialog):
+    def __init__(self, parent=None):
+        super(DatabaseConnectionDialog, self).__init__(parent)
+        self.connection = None
+        self.pool = None
+        self.setWindowTitle("Database Connection")
+        self.resize(400, 200)
+        main_layout = QVBoxLayout(self)
+        
+        label = QLabel("Select ODBC DSN or provide a custom connection string:")
+        main_layout.addWidget(label)
+        
+        self.dsn_combo = QComboBox()
+        try:
+            data_sources = pyodbc.dataSources()
+            dsns = [dsn for dsn, driver in data_sources.items() if _SQLSERVER_RE.search(driver)]
+            # One bulk insert so the combo's model signals a single change.
+            self.dsn_combo.addItems([f"ODBC DSN: {dsn}" for dsn in dsns])
+            for index, dsn in enumerate(dsns):
+                self.dsn_combo.setItemData(index, dsn)
+        except Exception as e:
+            logger.error("Error retrieving DSNs: %s", e)
+        main_layout.addWidget(self.dsn_combo)
+        
+        self.conn_str_edit = QLineEdit()
+        self.conn_str_edit.setPlaceholderText("Or enter custom connection string")
+        main_layout.addWidget(self.conn_str_edit)
+        
+        btn_layout = QHBoxLayout()
+        connect_btn = QPushButton("Connect")
+        connect_btn.clicked.connect(self.accept)
+        cancel_btn = QPushButton("Cancel")
+        cancel_btn.clicked.connect(self.reject)
+        btn_layout.addWidget(connect_btn)
+        btn_layout.addWidget(cancel_btn)
+        main_layout.addLayout(btn_layout)
+    
+    def get_connection(self):
+        override = self.conn_str_edit.text().strip()
+        if override:
+            conn_str = override
+        else:
+            dsn = self.dsn_combo.currentData()
+            if not dsn:
+                QMessageBox.critical(self, "Error", "No DSN selected.")
+                return None
+            conn_str = f"DSN={dsn};Trusted_Connection=yes;"
+        try:
+            # Connections handed out here go back with CONNECTIONS.release(conn).
+            self.pool = get_pool(conn_str)
+            conn = CONNECTIONS.get_connection(conn_str)
+            logger.info("Database connection established.")
+            return conn
+        except Exception as e:
+            QMessageBox.critical(self, "Connection Error", str(e))
+            logger.error("Database connection error: %s", e)
+            return None
+
+# -----------------------------------------------------------------------------
+# Background SQL Parsing
+# -----------------------------------------------------------------------------
+class _SqlParseSignals(QObject):
+    finished = pyqtSignal(object)
+
+class SqlParseJob(QRunnable):
+    """
+    Runs parse_sql_dependencies on a QThreadPool worker. The callback receives the
+    result dict on the thread that created the job (normally the UI thread).
+    """
+    def __init__(self, sql_text, callback):
+        super(SqlParseJob, self).__init__()
+        self.sql_text = sql_text
+        self.signals = _SqlParseSignals()
+        self.signals.finished.connect(callback)
+
+    def run(self):
+        self.signals.finished.emit(parse_sql_dependencies(self.sql_text))
+
+def parse_sql_dependencies_async(sql_text, callback):
+    """Parse on QThreadPool.globalInstance() and deliver the result to callback."""
+    QThreadPool.globalInstance().start(SqlParseJob(sql_text, callback))
+
+# End of core_qt.py
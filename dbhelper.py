@@ -33,17 +33,21 @@ Example:
 import sys
 import json
 import logging
+import logging.handlers
 import pyodbc
 from datetime import datetime
 from PyQt5 import QtWidgets
 from PyQt5.QtWidgets import (
     QDialog, QVBoxLayout, QLabel, QLineEdit, QPushButton, QMessageBox
 )
+from advlog import configure_logging, default_log_level, dump_json
 
 # Configure logger
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
-handler = logging.FileHandler('brm_tool_advanced.log')
+logger.setLevel(default_log_level())
+handler = logging.handlers.RotatingFileHandler(
+    'brm_tool_advanced.log', maxBytes=50 * 1024 * 1024, backupCount=10
+)
 formatter = logging.Formatter('%(asctime)s:%(levelname)s:%(name)s:%(message)s')
 handler.setFormatter(formatter)
 logger.addHandler(handler)
@@ -73,7 +77,7 @@ class DatabaseConnectionDialog(QtWidgets.QDialog):
                 if "SQL SERVER" in driver.upper():
                     self.dsn_combo.addItem(f"DSN: {dsn_name}", dsn_name)
         except Exception as ex:
-            logger.error(f"Error retrieving DSNs: {ex}")
+            logger.error("Error retrieving DSNs: %s", ex)
         layout.addWidget(self.dsn_combo)
 
         self.conn_str_edit = QLineEdit()
@@ -101,11 +105,11 @@ class DatabaseConnectionDialog(QtWidgets.QDialog):
             conn_str = f"DSN={dsn};Trusted_Connection=yes;"
         try:
             conn = pyodbc.connect(conn_str)
-            logger.info(f"Connected to database using: {conn_str}")
+            logger.info("Connected to database using: %s", conn_str)
             return conn
         except Exception as ex:
             QMessageBox.critical(self, "Connection Error", f"Error connecting to database: {ex}")
-            logger.error(f"Database connection failed with '{conn_str}': {ex}")
+            logger.error("Database connection failed with '%s': %s", conn_str, ex)
             return None
 
 
@@ -121,7 +125,7 @@ def fetch_all_dict(cursor):
             return result
         return rows
     except Exception as ex:
-        logger.error(f"Error fetching all rows as dict: {ex}")
+        logger.error("Error fetching all rows as dict: %s", ex)
         return []
 
 
@@ -136,7 +140,7 @@ def fetch_one_dict(cursor):
             return dict(zip(columns, row))
         return row
     except Exception as ex:
-        logger.error(f"Error fetching one row as dict: {ex}")
+        logger.error("Error fetching one row as dict: %s", ex)
         return None
 
 
@@ -158,13 +162,13 @@ def insert_audit_log(conn, action, table_name, record_id, actor, old_data, new_d
             table_name,
             str(record_id) if record_id is not None else None,
             actor,
-            json.dumps(old_data) if old_data is not None else None,
-            json.dumps(new_data) if new_data is not None else None
+            dump_json(old_data) if old_data is not None else None,
+            dump_json(new_data) if new_data is not None else None
         ))
         conn.commit()
-        logger.info(f"Audit log recorded for action '{action}' on table '{table_name}' (record {record_id}).")
+        logger.info("Audit log recorded for action '%s' on table '%s' (record %s).", action, table_name, record_id)
     except Exception as ex:
-        logger.error(f"Error inserting audit log: {ex}")
+        logger.error("Error inserting audit log: %s", ex)
 
 
 class LoginDialog(QDialog):
@@ -215,18 +219,19 @@ class LoginDialog(QDialog):
             if row:
                 self.user_id = row["USER_ID"]
                 self.user_group = row["USER_GROUP"]
-                logger.info(f"User '{username}' logged in successfully.")
+                logger.info("User '%s' logged in successfully.", username)
                 self.accept()
             else:
                 QMessageBox.warning(self, "Login Failed", "Invalid username or password.")
-                logger.warning(f"Failed login attempt for username: {username}")
+                logger.warning("Failed login attempt for username: %s", username)
         except Exception as ex:
             QMessageBox.critical(self, "Error", f"Error during login: {ex}")
-            logger.error(f"Login error for username '{username}': {ex}")
+            logger.error("Login error for username '%s': %s", username, ex)
 
 
 # For standalone testing
 if __name__ == '__main__':
+    configure_logging()
     app = QtWidgets.QApplication(sys.argv)
     conn_dlg = DatabaseConnectionDialog()
     if conn_dlg.exec_() == QDialog.Accepted: